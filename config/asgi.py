@@ -2,5 +2,18 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Lets settings size the live recognition limits for async serving
+os.environ.setdefault('DJANGO_ASGI', 'true')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, as it loads models
+from core import live_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # WebSocket connections (live attendance) are handled without Channels
+    if scope["type"] == "websocket":
+        await live_socket.application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
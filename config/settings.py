@@ -117,6 +117,108 @@ def _resolve_media_root() -> Path:
 
 MEDIA_ROOT = _resolve_media_root()
 
+
+def _resolve_gallery_cache_dir() -> Path:
+    """Pick a writable, non-public directory for the shared face gallery files."""
+    configured = os.environ.get('FACE_GALLERY_CACHE_DIR')
+    candidates: list[Path] = []
+    if configured:
+        candidates.append(Path(configured))
+    candidates.append(BASE_DIR / '.cache' / 'galleries')
+    candidates.append(Path('/tmp/edu_attend_galleries'))
+
+    for candidate in candidates:
+        try:
+            candidate.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            continue
+        return candidate
+
+    raise RuntimeError('No writable FACE_GALLERY_CACHE_DIR directory is available.')
+
+
+# Class galleries are written here once and memory-mapped by every worker.
+# Kept outside MEDIA_ROOT so encodings are never served as media.
+FACE_GALLERY_CACHE_DIR = _resolve_gallery_cache_dir()
+# Per-worker memory budget for cached class galleries (least recently used are evicted)
+FACE_GALLERY_CACHE_MAX_BYTES = int(os.environ.get('FACE_GALLERY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Live attendance sessions: a face is marked present once it has been matched to
+# the same student on FACE_TRACK_CONFIRM_FRAMES consecutive frames; tracked faces
+# skip re-encoding until FACE_TRACK_REVERIFY_SECONDS have passed.
+FACE_TRACK_CONFIRM_FRAMES = int(os.environ.get('FACE_TRACK_CONFIRM_FRAMES', 2))
+FACE_TRACK_REVERIFY_SECONDS = float(os.environ.get('FACE_TRACK_REVERIFY_SECONDS', 5))
+FACE_TRACK_IOU_THRESHOLD = 0.4
+FACE_SESSION_IDLE_SECONDS = 120
+# Each worker re-reads who is already present at least this often, so status
+# changes made through other workers reach live recognition
+FACE_PRESENT_SET_TTL_SECONDS = float(os.environ.get('FACE_PRESENT_SET_TTL_SECONDS', 10))
+
+# Live frames: JPEGs wider than FACE_ENCODE_MAX_WIDTH are decoded at a reduced
+# scale, faces are detected on a copy FACE_DETECT_WIDTH pixels wide, and
+# encodings are computed on the decoded frame.
+FACE_DETECT_WIDTH = int(os.environ.get('FACE_DETECT_WIDTH', 640))
+FACE_ENCODE_MAX_WIDTH = int(os.environ.get('FACE_ENCODE_MAX_WIDTH', 1280))
+
+# Live frames that are too dark, too blurry or nearly identical to the last
+# processed frame skip detection. Duplicates are still processed at least every
+# FACE_TRIAGE_MAX_SKIP_SECONDS so gallery changes are picked up.
+FACE_TRIAGE_MIN_BRIGHTNESS = float(os.environ.get('FACE_TRIAGE_MIN_BRIGHTNESS', 40))
+FACE_TRIAGE_MIN_SHARPNESS = float(os.environ.get('FACE_TRIAGE_MIN_SHARPNESS', 30))
+FACE_TRIAGE_DUPLICATE_DISTANCE = int(os.environ.get('FACE_TRIAGE_DUPLICATE_DISTANCE', 4))
+FACE_TRIAGE_MAX_SKIP_SECONDS = float(os.environ.get('FACE_TRIAGE_MAX_SKIP_SECONDS', 3))
+
+# Where face detection and encoding run (see core/recognition_pool.py): a shared
+# pool from `manage.py run_recognition_pool` at FACE_RECOGNITION_POOL_ADDRESS,
+# else FACE_RECOGNITION_WORKERS processes per web process, else inline.
+FACE_RECOGNITION_POOL_ADDRESS = os.environ.get('FACE_RECOGNITION_POOL_ADDRESS', '')
+# Required by the shared pool and its callers; use a long random value, distinct from DJANGO_SECRET_KEY
+FACE_RECOGNITION_POOL_AUTHKEY = os.environ.get('FACE_RECOGNITION_POOL_AUTHKEY', '')
+FACE_RECOGNITION_WORKERS = int(os.environ.get('FACE_RECOGNITION_WORKERS', 0))
+FACE_RECOGNITION_QUEUE_SIZE = int(os.environ.get('FACE_RECOGNITION_QUEUE_SIZE', max(1, FACE_RECOGNITION_WORKERS)))
+FACE_RECOGNITION_THREADS_PER_WORKER = int(os.environ.get('FACE_RECOGNITION_THREADS_PER_WORKER', 1))
+FACE_RECOGNITION_TIMEOUT_SECONDS = float(os.environ.get('FACE_RECOGNITION_TIMEOUT_SECONDS', 10))
+
+# Threads the async recognition view (ASGI deployments) hands frames to
+FACE_ASYNC_RECOGNITION_THREADS = int(os.environ.get('FACE_ASYNC_RECOGNITION_THREADS', os.cpu_count() or 2))
+
+# At most this many live frames are recognized at once across all web
+# processes; the rest get a 429. The default follows what runs the frames:
+# FACE_ASYNC_RECOGNITION_THREADS per process under ASGI (config/asgi.py sets
+# DJANGO_ASGI), else the recognition pool's processes, else WEB_CONCURRENCY - 1
+# so that sync workers always leave one free for page requests. Sync workers
+# also wait for the pool, so set it explicitly to keep one free there too.
+_web_concurrency = int(os.environ.get('WEB_CONCURRENCY', 2))
+if os.environ.get('DJANGO_ASGI', 'false').lower() == 'true':
+    _default_max_concurrency = _web_concurrency * FACE_ASYNC_RECOGNITION_THREADS
+elif FACE_RECOGNITION_POOL_ADDRESS:
+    # Same default as `run_recognition_pool --workers`
+    _default_max_concurrency = FACE_RECOGNITION_WORKERS or os.cpu_count() or 1
+elif FACE_RECOGNITION_WORKERS > 0:
+    _default_max_concurrency = _web_concurrency * FACE_RECOGNITION_WORKERS
+else:
+    _default_max_concurrency = max(1, _web_concurrency - 1)
+FACE_RECOGNITION_MAX_CONCURRENCY = int(os.environ.get('FACE_RECOGNITION_MAX_CONCURRENCY', _default_max_concurrency))
+
+# Bounds for the pacing hints sent to live cameras (see core/pacing.py)
+FACE_PACING_MIN_INTERVAL_MS = int(os.environ.get('FACE_PACING_MIN_INTERVAL_MS', 500))
+FACE_PACING_MAX_INTERVAL_MS = int(os.environ.get('FACE_PACING_MAX_INTERVAL_MS', 3000))
+FACE_PACING_MAX_WIDTH = int(os.environ.get('FACE_PACING_MAX_WIDTH', 960))
+FACE_PACING_MIN_WIDTH = int(os.environ.get('FACE_PACING_MIN_WIDTH', 480))
+
+# Photo and sample encoding runs in `manage.py run_encoding_worker`. Jobs
+# running longer than FACE_ENCODING_JOB_TIMEOUT_SECONDS are assumed lost and
+# retried, up to FACE_ENCODING_MAX_ATTEMPTS times. FACE_ENCODING_INLINE=true
+# encodes in the web process instead, for development without a worker.
+FACE_ENCODING_INLINE = os.environ.get('FACE_ENCODING_INLINE', 'false').lower() == 'true'
+FACE_ENCODING_JOB_TIMEOUT_SECONDS = int(os.environ.get('FACE_ENCODING_JOB_TIMEOUT_SECONDS', 600))
+FACE_ENCODING_MAX_ATTEMPTS = int(os.environ.get('FACE_ENCODING_MAX_ATTEMPTS', 3))
+
+# Photo encoding tries HOG, 2x upsampled HOG, then CNN detection, skipping
+# stages that would take the image past FACE_ENCODING_TIME_BUDGET_SECONDS (0: no limit).
+# CNN costs about 15 first HOG passes, so with 30 it still runs when that pass took up to 1.5s.
+FACE_ENCODING_TIME_BUDGET_SECONDS = float(os.environ.get('FACE_ENCODING_TIME_BUDGET_SECONDS', 30))
+
 _cloudinary_url = os.environ.get('CLOUDINARY_URL')
 if _cloudinary_url:
     INSTALLED_APPS += ['cloudinary', 'cloudinary_storage']
@@ -43,14 +43,24 @@ class StudentAdmin(admin.ModelAdmin):
     search_fields = ("user__first_name", "user__last_name", "user__email", "roll_number")
     # Require selecting an existing User when adding a Student in the admin
     raw_id_fields = ("user",)
-    # Show face_encodings but don't allow editing directly
-    readonly_fields = ("face_encodings",)
-    fields = ("user", "school_class", "roll_number", "photo", "face_encodings")
+    # Show whether an encoding exists but don't allow editing directly
+    readonly_fields = ("encoding_status",)
+    fields = ("user", "school_class", "roll_number", "photo", "encoding_status")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer("face_encodings")
 
     def get_full_name(self, obj):
         return obj.get_full_name()
     get_full_name.short_description = 'Name'
 
+    def encoding_status(self, obj):
+        if obj.has_encoding:
+            return "Encoding stored"
+        job = obj.encoding_jobs.filter(sample__isnull=True).order_by('-pk').first()
+        return job.get_status_display() if job else "Not generated"
+    encoding_status.short_description = 'Face encoding'
+
 @admin.register(Teacher)
 class TeacherAdmin(admin.ModelAdmin):
     list_display = ("user",)
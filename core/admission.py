@@ -0,0 +1,301 @@
+"""
+Admission control for live recognition requests.
+
+Recognizing a frame can take longer than the client's capture interval. If
+every request simply waited its turn, frames would pile up behind each other
+and tie up every gunicorn worker, stalling the rest of the site. Two rules
+keep that from happening, and neither ever makes a request wait:
+
+- Per session, one frame at a time. While a frame of a live session is being
+  processed, by whichever worker, further frames of that session are turned
+  away at once: with 429 and a retry hint, or with 409 if they are older
+  than the newest frame already seen (they arrived out of order). The client
+  then sends its newest frame, so the latest frame wins. The session's busy
+  flag and newest frame number live in files under ``FACE_GALLERY_CACHE_DIR``,
+  so every worker process sees them.
+- Globally, at most ``FACE_RECOGNITION_MAX_CONCURRENCY`` frames are processed
+  at once across all worker processes. The limit is a pool of lock files
+  under ``FACE_GALLERY_CACHE_DIR`` taken with non-blocking ``flock`` calls, so
+  a request over the limit is turned away at once rather than queued.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from django.conf import settings
+
+from .live_sessions import LiveSession
+
+try:  # pragma: no cover - POSIX only
+    import fcntl
+except ImportError:  # pragma: no cover - e.g. local Windows development
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class Busy(Exception):
+    """Too many frames are being processed; retry after ``retry_after_ms``."""
+
+    def __init__(self, retry_after_ms: int):
+        super().__init__(f"Recognition busy, retry after {retry_after_ms} ms")
+        self.retry_after_ms = retry_after_ms
+
+
+class SessionBusy(Busy):
+    """Another frame of the same session is being processed."""
+
+
+class Superseded(Exception):
+    """A newer frame from the same session arrived before this one was processed."""
+
+
+class SlotPool:
+    """
+    Fixed number of processing slots shared by every worker process.
+
+    A process in slot ``i`` holds an exclusive lock on ``slot-i.lock`` and a
+    shared lock on ``slot-i.held``. ``in_use`` probes only the ``.held``
+    files, so counting slots never makes a slot look taken to a process
+    trying to get one. Falls back to a per-process semaphore when file locks
+    are unavailable.
+    """
+
+    def __init__(self, size: int, directory: Path | str):
+        self.size = max(1, size)
+        self.directory = Path(directory)
+        self._use_files = fcntl is not None
+        self._local = threading.BoundedSemaphore(self.size)
+        self._local_held = 0
+        self._local_held_lock = threading.Lock()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one slot for the duration of the block, or raise ``Busy``."""
+        if self._use_files:
+            handles = self._lock_files()
+            if handles is not None:
+                try:
+                    yield
+                finally:
+                    for handle in handles:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+                        handle.close()
+                return
+            if self._use_files:
+                # Every slot is held by some process
+                raise Busy(retry_after_ms())
+
+        if not self._local.acquire(blocking=False):
+            raise Busy(retry_after_ms())
+        with self._local_held_lock:
+            self._local_held += 1
+        try:
+            yield
+        finally:
+            with self._local_held_lock:
+                self._local_held -= 1
+            self._local.release()
+
+    def in_use(self) -> int:
+        """How many slots are held right now, by any process. Only a snapshot."""
+        if not self._use_files:
+            with self._local_held_lock:
+                return self._local_held
+        held = 0
+        for index in range(self.size):
+            try:
+                with open(self.directory / f"slot-{index}.held", "a+b") as handle:
+                    # A holder only ever waits the instant this probe takes
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+            except OSError:
+                held += 1
+        return held
+
+    def _lock_files(self):
+        # Start at a random slot so processes don't all contend for slot 0
+        start = random.randrange(self.size)
+        for offset in range(self.size):
+            index = (start + offset) % self.size
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                handle = open(self.directory / f"slot-{index}.lock", "a+b")
+            except OSError as exc:
+                logger.warning("Limiting recognition slots per process, cannot use %s: %s", self.directory, exc)
+                self._use_files = False
+                return None
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            try:
+                marker = open(self.directory / f"slot-{index}.held", "a+b")
+            except OSError as exc:
+                # Give the slot back, or it would stay taken for the life of the process
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+                logger.warning("Limiting recognition slots per process, cannot use %s: %s", self.directory, exc)
+                self._use_files = False
+                return None
+            fcntl.flock(marker, fcntl.LOCK_SH)
+            return handle, marker
+        return None
+
+
+class SessionGates:
+    """
+    Per-session busy flag and newest frame number, shared by every worker process.
+
+    ``session-<class>-<user>.busy`` is locked while a frame of the session is
+    processed; ``session-<class>-<user>.seq`` holds the newest admitted frame
+    number and is locked only for the instant it is read and written. Falls
+    back to the ``LiveSession`` fields when file locks are unavailable.
+    """
+
+    def __init__(self, directory: Path | str):
+        self.directory = Path(directory)
+        self._use_files = fcntl is not None
+
+    @contextmanager
+    def hold(self, session: LiveSession, seq: int | None) -> Iterator[None]:
+        """Mark the session busy for the block, or raise ``SessionBusy``/``Superseded`` at once."""
+        if self._use_files:
+            busy = self._acquire_files(session, seq)
+            if busy is not None:
+                try:
+                    yield
+                finally:
+                    fcntl.flock(busy, fcntl.LOCK_UN)
+                    busy.close()
+                return
+
+        with session.lock:
+            session.latest_seq = _check_seq(seq, session.latest_seq, session.busy)
+            session.busy = True
+        try:
+            yield
+        finally:
+            with session.lock:
+                session.busy = False
+
+    def _acquire_files(self, session: LiveSession, seq: int | None):
+        name = f"session-{session.class_id}-{session.user_id}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            busy = open(self.directory / f"{name}.busy", "a+b")
+            seq_fd = os.open(self.directory / f"{name}.seq", os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as exc:
+            logger.warning("Tracking live sessions per process, cannot use %s: %s", self.directory, exc)
+            self._use_files = False
+            return None
+
+        try:
+            fcntl.flock(seq_fd, fcntl.LOCK_EX)
+            try:
+                latest = int(os.pread(seq_fd, 32, 0) or b"0")
+            except ValueError:
+                latest = 0
+            try:
+                fcntl.flock(busy, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                is_busy = False
+            except OSError:
+                is_busy = True
+            try:
+                latest = _check_seq(seq, latest, is_busy)
+            except BaseException:
+                if not is_busy:
+                    fcntl.flock(busy, fcntl.LOCK_UN)
+                busy.close()
+                raise
+            os.ftruncate(seq_fd, 0)
+            os.pwrite(seq_fd, str(latest).encode(), 0)
+        finally:
+            os.close(seq_fd)
+        return busy
+
+
+def _check_seq(seq: int | None, latest: int, busy: bool) -> int:
+    """Return the session's new newest frame number, or raise if the frame cannot go ahead."""
+    if seq is None:
+        seq = latest + 1
+    if busy:
+        if seq <= latest:
+            raise Superseded()
+        raise SessionBusy(retry_after_ms())
+    # When idle, a lower number just means the client restarted its count
+    # (e.g. the page was reloaded)
+    return seq
+
+
+_DIRECTORY = os.path.join(settings.FACE_GALLERY_CACHE_DIR, "admission")
+_POOL = SlotPool(size=settings.FACE_RECOGNITION_MAX_CONCURRENCY, directory=_DIRECTORY)
+_GATES = SessionGates(_DIRECTORY)
+
+# Moving average of how long one frame takes, used for the retry hint
+_AVERAGE_SECONDS = 0.5
+_AVERAGE_LOCK = threading.Lock()
+
+# When this process last turned a frame away, see ``load``
+_LAST_REJECTION = float("-inf")
+_REJECTION_WINDOW = 5.0
+
+
+def retry_after_ms() -> int:
+    with _AVERAGE_LOCK:
+        return max(100, int(_AVERAGE_SECONDS * 1000))
+
+
+def average_frame_ms() -> float:
+    with _AVERAGE_LOCK:
+        return _AVERAGE_SECONDS * 1000
+
+
+def note_rejection() -> None:
+    global _LAST_REJECTION
+    _LAST_REJECTION = time.monotonic()
+
+
+def load() -> float:
+    """
+    Rough measure from 0 (idle) to 1 (saturated) of how busy recognition is.
+
+    Meant to be called while processing a frame: the caller's own slot is not
+    counted, and any frame turned away in the last few seconds means saturated.
+    """
+    if time.monotonic() - _LAST_REJECTION < _REJECTION_WINDOW:
+        return 1.0
+    others = max(0, _POOL.in_use() - 1)
+    return min(1.0, others / _POOL.size)
+
+
+def _record_duration(seconds: float) -> None:
+    global _AVERAGE_SECONDS
+    with _AVERAGE_LOCK:
+        _AVERAGE_SECONDS = 0.8 * _AVERAGE_SECONDS + 0.2 * seconds
+
+
+@contextmanager
+def admit(session: LiveSession, seq: int | None = None) -> Iterator[None]:
+    """
+    Hold the session and a global slot while one frame is processed.
+
+    ``seq`` is the client's increasing frame number; without one the frame is
+    treated as the newest. Never waits: raises ``Superseded`` for a frame
+    older than the newest one seen while the session is busy,
+    ``SessionBusy`` for any other frame of a busy session, and ``Busy`` if no
+    global slot is free.
+    """
+    with _GATES.hold(session, seq):
+        with _POOL.slot():
+            started = time.monotonic()
+            yield
+            _record_duration(time.monotonic() - started)
@@ -0,0 +1,136 @@
+"""
+Content-addressed cache of face encodings.
+
+Encoding a photo is by far the most expensive thing the app does outside live
+recognition, and most of it is repeated work: ``regenerate_face_encodings
+--force`` re-encodes photos that have not changed, and a teacher uploading
+the same picture as a face sample twice encodes it twice. Results are keyed
+by the SHA-256 of the image bytes and ``face_utils.ENCODER_VERSION``, so an
+image is encoded once per encoder configuration. Bumping the version (a new
+face_recognition release or ``ENCODING_PIPELINE_VERSION``) makes every entry
+a miss without deleting anything.
+
+Images where no face was found are cached too, as an empty encoding, so they
+are not retried with the full detector cascade every time. When the cascade
+ran out of time before trying every stage, the empty result is cached under
+the time budget it had (see ``timed_out_version``): a larger budget misses
+that entry and tries the slower stages.
+
+Entries are deleted together with the last student photo or face sample
+whose encoding came from them (see ``forget``).
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+from dataclasses import dataclass
+from typing import Any
+
+from django.conf import settings
+
+from . import face_utils
+from .models import EncodingCache, FaceSample, Student
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EncodingResult:
+    source_hash: str
+    # Stored encoding bytes; empty when the image was unreadable or had no face
+    encoding: bytes
+    readable: bool = True
+    cached: bool = False
+    # Detection stage that found the face, and per-stage timings (see face_utils.encode_primary_face)
+    stage: str | None = None
+    timings: tuple[tuple[str, float], ...] = ()
+    timed_out: bool = False
+
+    @property
+    def version(self) -> str:
+        return face_utils.ENCODER_VERSION
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def timed_out_version(version: str, time_budget: float) -> str:
+    """Cache key version for an image that ran out of ``time_budget`` seconds before a face was found."""
+    return f"{version}/budget{time_budget:g}"
+
+
+def is_current(source_hash: str, stored_hash: str, stored_version: str) -> bool:
+    """Whether an encoding stored with ``stored_hash``/``stored_version`` is still valid for the image."""
+    return bool(stored_hash) and stored_hash == source_hash and stored_version == face_utils.ENCODER_VERSION
+
+
+def encode_bytes(data: bytes, source_hash: str | None = None) -> EncodingResult:
+    """Return the encoding for an image, computing and caching it on a miss."""
+    source_hash = source_hash or content_hash(data)
+    version = face_utils.ENCODER_VERSION
+    time_budget = settings.FACE_ENCODING_TIME_BUDGET_SECONDS
+    versions = [version]
+    if time_budget:
+        versions.append(timed_out_version(version, time_budget))
+    cached = dict(
+        EncodingCache.objects.filter(content_hash=source_hash, encoder_version__in=versions).values_list(
+            "encoder_version", "encoding"
+        )
+    )
+    if version in cached:
+        return EncodingResult(source_hash, bytes(cached[version]), cached=True)
+    if len(versions) > 1 and versions[1] in cached:
+        return EncodingResult(source_hash, b"", cached=True, timed_out=True)
+
+    image_array = face_utils.image_to_array(io.BytesIO(data))
+    if image_array is None:
+        # Not cached: a newer Pillow may well read it
+        return EncodingResult(source_hash, b"", readable=False)
+
+    attempt = face_utils.encode_primary_face(image_array, time_budget=time_budget)
+    encoded = face_utils.encoding_to_bytes(attempt.encoding) if attempt.encoding is not None else b""
+    entry_version = timed_out_version(version, time_budget) if attempt.timed_out else version
+    # Another process may have encoded the same image meanwhile; either row will do
+    EncodingCache.objects.bulk_create(
+        [EncodingCache(content_hash=source_hash, encoder_version=entry_version, encoding=encoded)],
+        ignore_conflicts=True,
+    )
+    return EncodingResult(
+        source_hash, encoded, stage=attempt.stage, timings=attempt.timings, timed_out=attempt.timed_out
+    )
+
+
+def forget(source_hash: str) -> int:
+    """
+    Delete the cached encodings of an image no student photo or face sample uses any more.
+
+    Encodings are biometric data, so they should not outlive the records
+    they were computed for. Returns the number of rows deleted.
+    """
+    if not source_hash:
+        return 0
+    if (
+        Student.objects.filter(encoding_source_hash=source_hash).exists()
+        or FaceSample.objects.filter(encoding_source_hash=source_hash).exists()
+    ):
+        return 0
+    deleted, _ = EncodingCache.objects.filter(content_hash=source_hash).delete()
+    return deleted
+
+
+def read_image(file_field: Any) -> tuple[bytes, str]:
+    """Return the bytes of a stored image field and their content hash.
+
+    ``FileNotFoundError`` propagates so callers can report missing files.
+    """
+    with file_field.open("rb") as handle:
+        data = handle.read()
+    return data, content_hash(data)
+
+
+def encode_file(file_field: Any) -> EncodingResult:
+    """Open a stored image field and return its encoding."""
+    data, source_hash = read_image(file_field)
+    return encode_bytes(data, source_hash)
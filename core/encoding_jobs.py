@@ -0,0 +1,156 @@
+"""
+Database-backed queue for encoding student photos and face samples.
+
+Encoding a photo runs the full detector cascade, including the CNN fallback,
+which can take several seconds on a CPU. Saving a ``Student`` or a
+``FaceSample`` therefore only records an ``EncodingJob`` (see
+``signals.py``), and ``manage.py run_encoding_worker`` does the encoding
+out of band. The queue is an ordinary table, so no broker is needed. Workers
+claim jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it. A conditional update makes the claim safe on SQLite too, so
+several workers can share the queue.
+
+With ``FACE_ENCODING_INLINE`` set, jobs run in the saving process once its
+transaction commits, like before. That is handy for ``runserver`` without a
+worker.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import encoding_cache, face_utils
+from .models import EncodingJob, FaceSample, Student
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(student_id: int, sample_id: int | None = None) -> EncodingJob | None:
+    """Queue the student's photo (or one of their samples) unless it is already queued."""
+    queued = EncodingJob.objects.filter(
+        student_id=student_id, sample_id=sample_id, status__in=(EncodingJob.PENDING, EncodingJob.RUNNING)
+    )
+    if queued.exists():
+        return None
+    job = EncodingJob.objects.create(student_id=student_id, sample_id=sample_id)
+    if settings.FACE_ENCODING_INLINE and face_utils.FACE_RECOGNITION_AVAILABLE:
+        transaction.on_commit(lambda: run_pending(job.pk))
+    return job
+
+
+def claim_next() -> EncodingJob | None:
+    """Mark the oldest pending job as running and return it, or ``None`` if the queue is empty."""
+    while True:
+        with transaction.atomic():
+            job = (
+                EncodingJob.objects.select_for_update(skip_locked=True)
+                .filter(status=EncodingJob.PENDING)
+                .order_by("pk")
+                .first()
+            )
+            if job is None:
+                return None
+            if _claim(job):
+                return job
+        # Another worker got there first (no row locks on SQLite); try the next one
+
+
+def _claim(job: EncodingJob) -> bool:
+    now = timezone.now()
+    claimed = EncodingJob.objects.filter(pk=job.pk, status=EncodingJob.PENDING).update(
+        status=EncodingJob.RUNNING, attempts=F("attempts") + 1, started_at=now
+    )
+    if claimed:
+        job.status = EncodingJob.RUNNING
+        job.attempts += 1
+        job.started_at = now
+    return bool(claimed)
+
+
+def run_pending(job_id: int) -> None:
+    """Run one specific job now, if nobody else has claimed it."""
+    job = EncodingJob.objects.filter(pk=job_id, status=EncodingJob.PENDING).first()
+    if job is not None and _claim(job):
+        # Inline jobs have no worker to retry them, so a failure is final
+        run(job, retry=False)
+
+
+def run(job: EncodingJob, retry: bool = True) -> str:
+    """
+    Encode a claimed job's image, store the encoding and record the outcome.
+
+    A job that raises goes back to the queue for another attempt, up to
+    ``FACE_ENCODING_MAX_ATTEMPTS``, unless ``retry`` is false.
+    """
+    try:
+        status, error = _encode_sample(job.sample_id) if job.sample_id else _encode_photo(job.student_id)
+    except FileNotFoundError:
+        status, error = EncodingJob.FAILED, "Image file is missing."
+    except (Student.DoesNotExist, FaceSample.DoesNotExist):
+        # Deleted while queued; the job row went with it
+        return EncodingJob.FAILED
+    except Exception as exc:
+        logger.exception("Encoding job %s failed", job.pk)
+        retry = retry and job.attempts < settings.FACE_ENCODING_MAX_ATTEMPTS
+        status, error = (EncodingJob.PENDING if retry else EncodingJob.FAILED), str(exc)[:255]
+
+    # update() rather than save(): saving a job whose row was deleted meanwhile would re-insert it
+    EncodingJob.objects.filter(pk=job.pk).update(
+        status=status,
+        error=error,
+        finished_at=None if status == EncodingJob.PENDING else timezone.now(),
+    )
+    job.status, job.error = status, error
+    return status
+
+
+def _store_outcome(instance, field: str, data: bytes, source_hash: str, current: bool) -> tuple[str, str]:
+    if current:
+        return EncodingJob.DONE, ""
+    result = encoding_cache.encode_bytes(data, source_hash)
+    if not result.readable:
+        return EncodingJob.FAILED, "The image could not be read."
+    if not result.encoding:
+        if result.timed_out:
+            return EncodingJob.NO_FACE, "Gave up on slower detectors to stay within the time budget."
+        return EncodingJob.NO_FACE, ""
+    setattr(instance, field, result.encoding)
+    instance.encoding_source_hash = result.source_hash
+    instance.encoding_version = result.version
+    instance.save(update_fields=[field, "encoding_source_hash", "encoding_version"])
+    return EncodingJob.DONE, ""
+
+
+def _encode_photo(student_id: int) -> tuple[str, str]:
+    student = Student.objects.defer("face_encodings").get(pk=student_id)
+    if not student.photo:
+        return EncodingJob.FAILED, "The student has no photo."
+    data, source_hash = encoding_cache.read_image(student.photo)
+    current = student.has_encoding and encoding_cache.is_current(
+        source_hash, student.encoding_source_hash, student.encoding_version
+    )
+    return _store_outcome(student, "face_encodings", data, source_hash, current)
+
+
+def _encode_sample(sample_id: int) -> tuple[str, str]:
+    sample = FaceSample.objects.get(pk=sample_id)
+    data, source_hash = encoding_cache.read_image(sample.image)
+    current = bool(sample.encoding) and encoding_cache.is_current(
+        source_hash, sample.encoding_source_hash, sample.encoding_version
+    )
+    return _store_outcome(sample, "encoding", data, source_hash, current)
+
+
+def requeue_stale() -> int:
+    """Return jobs left running by a worker that died to the queue, or fail them after too many attempts."""
+    cutoff = timezone.now() - timedelta(seconds=settings.FACE_ENCODING_JOB_TIMEOUT_SECONDS)
+    stale = EncodingJob.objects.filter(status=EncodingJob.RUNNING, started_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.FACE_ENCODING_MAX_ATTEMPTS).update(
+        status=EncodingJob.FAILED, error="The worker stopped while encoding.", finished_at=timezone.now()
+    )
+    return failed + stale.update(status=EncodingJob.PENDING)
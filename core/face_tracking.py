@@ -0,0 +1,145 @@
+"""
+Frame-to-frame face tracking for a live attendance session.
+
+Students mostly sit still between capture ticks, so a face found in roughly
+the same place as in the previous frame is very likely the same person. The
+tracker associates new boxes with existing tracks by intersection-over-union
+(IoU). Confirmed tracks lend their identity to the new box without computing
+a fresh 128-d encoding, and they are re-verified periodically. A track is
+confirmed once the same student has been matched on several frames in a row,
+so a single-frame false positive never marks anyone present.
+"""
+from __future__ import annotations
+
+import itertools
+from dataclasses import dataclass
+from typing import Sequence
+
+Box = Sequence[int]  # (top, right, bottom, left), as returned by face_recognition
+
+
+def iou(a: Box, b: Box) -> float:
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    intersection = (right - left) * (bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def best_overlap(box: Box, candidates: Sequence[Box], threshold: float) -> int | None:
+    """Index of the candidate overlapping ``box`` the most, if at or above ``threshold``."""
+    best_index, best_score = None, threshold
+    for index, candidate in enumerate(candidates):
+        score = iou(box, candidate)
+        if score >= best_score:
+            best_index, best_score = index, score
+    return best_index
+
+
+@dataclass
+class Track:
+    track_id: int
+    box: tuple[int, int, int, int]
+    student_id: int | None
+    name: str
+    metric: float | None
+    votes: int
+    verified_at: float
+    missed: int = 0
+
+
+class FaceTracker:
+    def __init__(self, confirm_frames: int = 2, reverify_seconds: float = 5.0, iou_threshold: float = 0.4, max_missed: int = 2):
+        self.confirm_frames = confirm_frames
+        self.reverify_seconds = reverify_seconds
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks: list[Track] = []
+        self._ids = itertools.count(1)
+
+    def is_confirmed(self, track: Track) -> bool:
+        return track.student_id is not None and track.votes >= self.confirm_frames
+
+    def has_unconfirmed(self) -> bool:
+        """True while some identified face still needs more frames to be confirmed."""
+        return any(track.student_id is not None and not self.is_confirmed(track) for track in self.tracks)
+
+    def reusable_boxes(self, now: float) -> list[tuple[int, int, int, int]]:
+        """Boxes of confirmed tracks whose identity can be reused without re-encoding."""
+        return [
+            track.box
+            for track in self.tracks
+            if self.is_confirmed(track) and now - track.verified_at < self.reverify_seconds
+        ]
+
+    def update(self, detections: list[dict], now: float) -> list[dict]:
+        """
+        Associate this frame's detections with tracks and return them annotated.
+
+        Detections flagged ``reused`` carry no identity of their own and take
+        it from their track. Every detection gains ``track_id`` and
+        ``confirmed`` keys.
+        """
+        pairs = sorted(
+            (
+                (iou(detection["box"], track.box), d_index, t_index)
+                for d_index, detection in enumerate(detections)
+                for t_index, track in enumerate(self.tracks)
+            ),
+            reverse=True,
+        )
+        assigned: dict[int, Track] = {}
+        used_tracks: set[int] = set()
+        for score, d_index, t_index in pairs:
+            if score < self.iou_threshold:
+                break
+            if d_index in assigned or t_index in used_tracks:
+                continue
+            assigned[d_index] = self.tracks[t_index]
+            used_tracks.add(t_index)
+
+        tracks: list[Track] = []
+        for d_index, detection in enumerate(detections):
+            box = tuple(detection["box"])
+            track = assigned.get(d_index)
+            if track is None:
+                track = Track(
+                    track_id=next(self._ids),
+                    box=box,
+                    student_id=None,
+                    name="Unknown",
+                    metric=None,
+                    votes=0,
+                    verified_at=now,
+                )
+            track.box = box
+            track.missed = 0
+
+            if detection.get("reused"):
+                detection.update(student_id=track.student_id, name=track.name, metric=track.metric)
+            else:
+                if detection["student_id"] is not None and detection["student_id"] == track.student_id:
+                    track.votes += 1
+                else:
+                    track.votes = 1 if detection["student_id"] is not None else 0
+                track.student_id = detection["student_id"]
+                track.name = detection["name"]
+                track.metric = detection["metric"]
+                track.verified_at = now
+
+            detection["track_id"] = track.track_id
+            detection["confirmed"] = self.is_confirmed(track)
+            tracks.append(track)
+
+        # Keep briefly occluded faces around for a few frames
+        for t_index, track in enumerate(self.tracks):
+            if t_index in used_tracks:
+                continue
+            track.missed += 1
+            if track.missed <= self.max_missed:
+                tracks.append(track)
+
+        self.tracks = tracks
+        return detections
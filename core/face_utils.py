@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import logging
+import time
+from dataclasses import dataclass
 from typing import Any
 
 import numpy as np
+from django.conf import settings
 from PIL import Image, ImageOps
 
 try:  # pragma: no cover - optional dependency
@@ -15,64 +18,181 @@ logger = logging.getLogger(__name__)
 
 FACE_RECOGNITION_AVAILABLE = face_recognition is not None
 
+# Encodings are stored as 128 little-endian float32 values (512 bytes).
+ENCODING_DTYPE = np.dtype("<f4")
 
-def image_to_array(file_obj: Any) -> np.ndarray | None:
-    """Return a RGB numpy array from a Django File-like object, handling EXIF rotation."""
+# Bump when image_to_array or encode_primary_face change in a way that
+# changes the encodings they produce; stored encodings record ENCODER_VERSION.
+ENCODING_PIPELINE_VERSION = 3
+ENCODER_VERSION = f"fr-{getattr(face_recognition, '__version__', 'none')}/p{ENCODING_PIPELINE_VERSION}"
+
+
+def encoding_to_bytes(encoding: Any) -> bytes:
+    """Serialise a face encoding for the binary ``face_encodings``/``encoding`` columns."""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def encoding_from_bytes(data: Any) -> np.ndarray | None:
+    """Return a read-only float32 view over a stored encoding without copying it."""
+    if not data:
+        return None
+    try:
+        return np.frombuffer(data, dtype=ENCODING_DTYPE)
+    except (TypeError, ValueError):
+        logger.warning("Ignoring malformed stored face encoding of %s bytes", len(data))
+        return None
+
+
+# Photos are encoded at no more than this many pixels on the long side
+IMAGE_MAX_SIDE = 1600
+
+
+def open_for_encoding(file_obj: Any, max_side: int = IMAGE_MAX_SIDE, fast: bool = True) -> Image.Image:
+    """Open an image without decoding it, set up for a reduced-scale decode if ``fast``."""
+    image = Image.open(file_obj)
+    long_side = max(image.size)
+    if fast and long_side > max_side:
+        # draft() keeps each side at least as large as requested, so ask for
+        # the target size with the image's own aspect ratio. EXIF rotation
+        # comes later but does not change the long side.
+        target = (max(1, image.width * max_side // long_side), max(1, image.height * max_side // long_side))
+        image.draft("RGB", target)
+    return image
+
+
+def image_to_array(file_obj: Any, max_side: int = IMAGE_MAX_SIDE, fast: bool = True) -> np.ndarray | None:
+    """
+    Return a RGB numpy array from a Django File-like object, handling EXIF rotation.
+
+    Images are reduced to ``max_side`` pixels on the long side. With ``fast``
+    (the default), large JPEGs are decoded at 1/2, 1/4 or 1/8 scale straight
+    from the DCT coefficients via ``draft()``, so a 12 MP phone photo is never
+    decoded at full size. The remaining reduction is always less than 2x and
+    uses bilinear resampling; the face encoder works on 150 px face chips, so
+    LANCZOS buys nothing there. ``fast=False`` is the full decode plus LANCZOS
+    path, kept for comparison (see ``manage.py benchmark_image_ingest``).
+    """
     try:
-        image = Image.open(file_obj)
+        image = open_for_encoding(file_obj, max_side, fast)
     except Exception as exc:  # pragma: no cover - best effort logging
         logger.warning("Failed opening image for encoding: %s", exc)
         return None
 
     image = ImageOps.exif_transpose(image).convert("RGB")
 
-    max_side = 1600
     if max(image.size) > max_side:
-        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        resample = Image.Resampling.BILINEAR if fast else Image.Resampling.LANCZOS
+        image.thumbnail((max_side, max_side), resample)
 
     return np.array(image)
 
 
-def extract_first_encoding(image_array: np.ndarray) -> np.ndarray | None:
-    """Return the first encoding using incremental fallbacks for tough images."""
+def decode_frame(source: Any, max_width: int | None = None) -> tuple[np.ndarray, float]:
+    """
+    Decode a camera frame to an RGB array, reduced in the JPEG decoder if wide.
+
+    For JPEGs wider than ``max_width`` Pillow's ``draft()`` decodes at 1/2,
+    1/4 or 1/8 scale directly from the DCT coefficients, which is much cheaper
+    than decoding at full size and resizing. Returns the array and the factor
+    that maps its coordinates back to the original frame.
+    """
+    image = Image.open(source)
+    source_width = image.width
+    if max_width and image.width > max_width:
+        # draft() never goes below the requested size, and is a no-op for non-JPEGs
+        image.draft("RGB", (max_width, max(1, image.height * max_width // image.width)))
+    frame = np.array(image.convert("RGB"))
+    return frame, source_width / frame.shape[1]
+
+
+@dataclass(frozen=True)
+class EncodingAttempt:
+    """Outcome of ``encode_primary_face``: the encoding, if any, and what it cost."""
+    encoding: np.ndarray | None
+    # Stage that produced the encoding, None if no stage did
+    stage: str | None
+    # (stage, seconds) for every stage that ran, in order
+    timings: tuple[tuple[str, float], ...]
+    # True if stages were skipped for lack of time, so "no face" is not final
+    timed_out: bool = False
+
+    @property
+    def elapsed(self) -> float:
+        return sum(seconds for _, seconds in self.timings)
+
+
+# (name, upsample, model, expected cost relative to the first stage). Each
+# stage is only tried when the previous ones found nothing.
+DETECTION_STAGES = (
+    ("hog", 1, "hog", 1.0),
+    ("hog_upsample", 2, "hog", 4.0),
+    ("cnn", 0, "cnn", 15.0),
+)
+
+
+def _primary_face(locations, shape) -> tuple[int, int, int, int]:
+    """The largest face, and of equally large ones the one nearest the centre."""
+    centre_y, centre_x = shape[0] / 2, shape[1] / 2
+
+    def key(box):
+        top, right, bottom, left = box
+        distance = abs((top + bottom) / 2 - centre_y) + abs((left + right) / 2 - centre_x)
+        return (-(bottom - top) * (right - left), distance)
+
+    return min(locations, key=key)
+
+
+def encode_primary_face(image_array: np.ndarray, time_budget: float | None = None) -> EncodingAttempt:
+    """
+    Encode the main face of a photo, trying ever more expensive detectors.
+
+    Only the primary face (see ``_primary_face``) is encoded, not every face
+    found. A stage is skipped when, judged by how long the first stage took,
+    it would overrun ``time_budget`` seconds (default
+    ``FACE_ENCODING_TIME_BUDGET_SECONDS``; 0 or None means no limit).
+    """
     if face_recognition is None:
-        return None
+        return EncodingAttempt(None, None, ())
+    if time_budget is None:
+        time_budget = settings.FACE_ENCODING_TIME_BUDGET_SECONDS
+
+    timings: list[tuple[str, float]] = []
+    base_cost = None
+    for name, upsample, model, relative_cost in DETECTION_STAGES:
+        spent = sum(seconds for _, seconds in timings)
+        if time_budget and base_cost is not None and spent + base_cost * relative_cost > time_budget:
+            logger.debug("Skipping %s detection: about %.1fs left of the time budget", name, time_budget - spent)
+            return EncodingAttempt(None, None, tuple(timings), timed_out=True)
+
+        started = time.perf_counter()
+        try:
+            locations = face_recognition.face_locations(  # type: ignore[attr-defined]
+                image_array,
+                number_of_times_to_upsample=upsample,
+                model=model,
+            )
+        except Exception as exc:  # pragma: no cover - optional model support
+            logger.debug("%s face detection failed: %s", name, exc, exc_info=True)
+            locations = []
+        encodings = []
+        if locations:
+            encodings = face_recognition.face_encodings(  # type: ignore[attr-defined]
+                image_array,
+                known_face_locations=[_primary_face(locations, image_array.shape)],
+            )
+        seconds = time.perf_counter() - started
+        timings.append((name, seconds))
+        if base_cost is None:
+            base_cost = seconds / relative_cost
 
-    encodings = list(face_recognition.face_encodings(image_array))  # type: ignore[attr-defined]
-    if encodings:
-        return encodings[0]
-
-    hog_locations = face_recognition.face_locations(  # type: ignore[attr-defined]
-        image_array,
-        number_of_times_to_upsample=2,
-        model="hog",
-    )
-    if hog_locations:
-        encodings = face_recognition.face_encodings(  # type: ignore[attr-defined]
-            image_array,
-            known_face_locations=hog_locations,
-        )
         if encodings:
-            logger.debug("Generated encoding using hog fallback for %s face(s)", len(encodings))
-            return encodings[0]
+            if name != DETECTION_STAGES[0][0]:
+                logger.debug("Generated encoding using %s fallback (%s face(s) found)", name, len(locations))
+            return EncodingAttempt(encodings[0], name, tuple(timings))
 
-    try:
-        cnn_locations = face_recognition.face_locations(  # type: ignore[attr-defined]
-            image_array,
-            number_of_times_to_upsample=0,
-            model="cnn",
-        )
-    except Exception as exc:  # pragma: no cover - optional model support
-        logger.debug("CNN face detection fallback failed: %s", exc, exc_info=True)
-        cnn_locations = []
-
-    if cnn_locations:
-        encodings = face_recognition.face_encodings(  # type: ignore[attr-defined]
-            image_array,
-            known_face_locations=cnn_locations,
-        )
-        if encodings:
-            logger.debug("Generated encoding using cnn fallback for %s face(s)", len(encodings))
-            return encodings[0]
+    return EncodingAttempt(None, None, tuple(timings))
 
-    return None
+
+def extract_first_encoding(image_array: np.ndarray) -> np.ndarray | None:
+    """Return the encoding of the main face, using incremental fallbacks for tough images."""
+    return encode_primary_face(image_array).encoding
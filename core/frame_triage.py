@@ -0,0 +1,100 @@
+"""
+Cheap checks that decide whether a live frame is worth running detection on.
+
+Face detection is by far the most expensive part of handling a live frame,
+yet many frames are near-copies of the previous one (nobody moved) or are
+unusable because the device is being moved around or the room is dark. The
+checks here take around a millisecond on a webcam frame:
+
+- a 64-bit difference hash (dHash) of the frame, compared with the hash of the
+  session's last processed frame, to catch duplicates;
+- the variance of the Laplacian as a sharpness measure, to catch motion blur;
+- the mean grey level, to catch frames that are too dark.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import cv2  # optional, much faster than the numpy fallbacks
+except Exception:  # pragma: no cover - runtime import fallback
+    cv2 = None  # type: ignore
+
+SKIP_DUPLICATE = "duplicate"
+SKIP_BLURRY = "blurry"
+SKIP_DARK = "dark"
+
+
+@dataclass(frozen=True)
+class TriageResult:
+    frame_hash: int
+    sharpness: float
+    brightness: float
+    skip_reason: str | None = None
+
+
+def _grayscale(frame_rgb: np.ndarray) -> np.ndarray:
+    if cv2 is not None:
+        return cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2GRAY)
+    return (frame_rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8)
+
+
+def difference_hash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """Perceptual hash: one bit per horizontally adjacent pair of a tiny thumbnail."""
+    if cv2 is not None:
+        thumb = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    else:
+        rows = np.linspace(0, gray.shape[0] - 1, hash_size).astype(int)
+        cols = np.linspace(0, gray.shape[1] - 1, hash_size + 1).astype(int)
+        thumb = gray[np.ix_(rows, cols)]
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def sharpness(gray: np.ndarray) -> float:
+    """Variance of the Laplacian; low values mean a blurry frame."""
+    if cv2 is not None:
+        return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    g = gray.astype(np.float32)
+    laplacian = g[:-2, 1:-1] + g[2:, 1:-1] + g[1:-1, :-2] + g[1:-1, 2:] - 4 * g[1:-1, 1:-1]
+    return float(laplacian.var())
+
+
+def triage(frame_rgb: np.ndarray, previous_hash: int | None = None, allow_duplicate: bool = False) -> TriageResult:
+    """
+    Measure ``frame_rgb`` and decide whether detection should be skipped.
+
+    ``previous_hash`` is the hash of the last frame that was processed for the
+    session. Pass ``allow_duplicate`` when a near-identical frame should still
+    be processed, e.g. while a face waits for its confirming frames.
+    """
+    gray = _grayscale(frame_rgb)
+    frame_hash = difference_hash(gray)
+    brightness = float(gray.mean())
+    frame_sharpness = sharpness(gray)
+
+    skip_reason = None
+    if brightness < settings.FACE_TRIAGE_MIN_BRIGHTNESS:
+        skip_reason = SKIP_DARK
+    elif frame_sharpness < settings.FACE_TRIAGE_MIN_SHARPNESS:
+        skip_reason = SKIP_BLURRY
+    elif (
+        not allow_duplicate
+        and previous_hash is not None
+        and hash_distance(frame_hash, previous_hash) <= settings.FACE_TRIAGE_DUPLICATE_DISTANCE
+    ):
+        skip_reason = SKIP_DUPLICATE
+
+    return TriageResult(
+        frame_hash=frame_hash,
+        sharpness=frame_sharpness,
+        brightness=brightness,
+        skip_reason=skip_reason,
+    )
@@ -0,0 +1,127 @@
+"""
+Per-class face galleries held as one contiguous float32 matrix.
+
+Every row of ``encodings`` is one known face (a student's main photo or one
+of their samples) and ``student_ids`` says who it belongs to. Matching all
+faces of a frame is then a single matrix product instead of a Python loop.
+"""
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Sequence
+
+import numpy as np
+
+ENCODING_DIMENSIONS = 128
+
+
+@dataclass(frozen=True)
+class FaceGallery:
+    encodings: np.ndarray
+    student_ids: np.ndarray
+    names: dict[int, str] = field(default_factory=dict)
+    squared_norms: np.ndarray = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        encodings = np.ascontiguousarray(self.encodings, dtype=np.float32).reshape(-1, ENCODING_DIMENSIONS)
+        student_ids = np.ascontiguousarray(self.student_ids, dtype=np.int64).reshape(-1)
+        if len(encodings) != len(student_ids):
+            raise ValueError("encodings and student_ids must have the same number of rows")
+        object.__setattr__(self, "encodings", encodings)
+        object.__setattr__(self, "student_ids", student_ids)
+        object.__setattr__(self, "squared_norms", np.einsum("ij,ij->i", encodings, encodings))
+
+    @classmethod
+    def empty(cls) -> "FaceGallery":
+        return cls(
+            encodings=np.empty((0, ENCODING_DIMENSIONS), dtype=np.float32),
+            student_ids=np.empty(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[int, Sequence[float]]], names: dict[int, str]) -> "FaceGallery":
+        """Build a gallery from ``(student_id, encoding)`` pairs, skipping malformed encodings."""
+        student_ids: list[int] = []
+        encodings: list[np.ndarray] = []
+        for student_id, encoding in rows:
+            try:
+                vector = np.asarray(encoding, dtype=np.float32)
+            except (ValueError, TypeError):
+                continue
+            if vector.shape != (ENCODING_DIMENSIONS,):
+                continue
+            student_ids.append(student_id)
+            encodings.append(vector)
+        matrix = np.stack(encodings) if encodings else np.empty((0, ENCODING_DIMENSIONS), dtype=np.float32)
+        return cls(encodings=matrix, student_ids=np.array(student_ids, dtype=np.int64), names=dict(names))
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint: the arrays plus the names map."""
+        names_bytes = sys.getsizeof(self.names) + sum(
+            sys.getsizeof(pk) + sys.getsizeof(name) for pk, name in self.names.items()
+        )
+        return self.encodings.nbytes + self.student_ids.nbytes + self.squared_norms.nbytes + names_bytes
+
+    def with_rows(self, student_id: int, encodings: Sequence[Sequence[float]], name: str | None = None) -> "FaceGallery":
+        """Return a copy with ``encodings`` appended for ``student_id``."""
+        extra = FaceGallery.from_rows(((student_id, encoding) for encoding in encodings), {})
+        names = dict(self.names)
+        if name is not None:
+            names[student_id] = name
+        return FaceGallery(
+            encodings=np.concatenate((self.encodings, extra.encodings)),
+            student_ids=np.concatenate((self.student_ids, extra.student_ids)),
+            names=names,
+        )
+
+    def without_student(self, student_id: int) -> "FaceGallery":
+        """Return a copy with every row of ``student_id`` removed."""
+        keep = self.student_ids != student_id
+        names = {pk: name for pk, name in self.names.items() if pk != student_id}
+        return FaceGallery(encodings=self.encodings[keep], student_ids=self.student_ids[keep], names=names)
+
+    def _row_indices(self, student_id: int, encoding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(encoding, dtype=np.float32)
+        return np.flatnonzero((self.student_ids == student_id) & np.all(self.encodings == vector, axis=1))
+
+    def has_row(self, student_id: int, encoding: Sequence[float]) -> bool:
+        return bool(len(self._row_indices(student_id, encoding)))
+
+    def without_row(self, student_id: int, encoding: Sequence[float]) -> "FaceGallery":
+        """Return a copy with the first row equal to ``encoding`` for ``student_id`` removed."""
+        candidates = self._row_indices(student_id, encoding)
+        if not len(candidates):
+            return self
+        keep = np.ones(len(self), dtype=bool)
+        keep[candidates[0]] = False
+        return FaceGallery(encodings=self.encodings[keep], student_ids=self.student_ids[keep], names=dict(self.names))
+
+    def match(self, face_encodings: Sequence[np.ndarray] | np.ndarray, tolerance: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Match every probe encoding against the gallery in one pass.
+
+        Returns ``(student_ids, distances)``, both with one entry per probe.
+        ``student_ids`` holds ``-1`` where the best distance exceeds
+        ``tolerance``; ``distances`` is ``nan`` when the gallery is empty.
+        """
+        probes = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIMENSIONS)
+        unmatched = np.full(len(probes), -1, dtype=np.int64)
+        if not len(probes) or not len(self):
+            return unmatched, np.full(len(probes), np.nan, dtype=np.float32)
+
+        # ||p - g||^2 = ||p||^2 + ||g||^2 - 2 p.g, computed for all pairs at once
+        squared = probes @ self.encodings.T
+        squared *= -2.0
+        squared += np.einsum("ij,ij->i", probes, probes)[:, None]
+        squared += self.squared_norms[None, :]
+        np.maximum(squared, 0.0, out=squared)
+
+        best = squared.argmin(axis=1)
+        distances = np.sqrt(squared[np.arange(len(probes)), best])
+        student_ids = np.where(distances <= tolerance, self.student_ids[best], unmatched)
+        return student_ids, distances
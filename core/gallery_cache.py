@@ -0,0 +1,285 @@
+"""
+Per-process cache of class galleries, invalidated by generation counters.
+
+Every change that affects a class gallery (a student joining, leaving or
+getting a new encoding, a face sample being added or removed) bumps that
+class's ``GalleryGeneration`` row from the model signals in ``signals.py``.
+A cached gallery is served for as long as its generation matches the one in
+the database, so nothing is reloaded while a class is unchanged and a change
+is picked up on the very next frame.
+
+The worker that handled the change also patches its own cached gallery in
+place of a full reload (see ``apply_student_change`` and friends) and writes
+the result to the shared gallery store, so the other workers only need to
+memory-map the new file.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import face_utils, recognition_service
+from .gallery import FaceGallery
+from .gallery_store import GalleryStore
+from .models import GalleryGeneration
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class _CacheEntry:
+    generation: int
+    gallery: FaceGallery
+    # ``GalleryGeneration.store_token`` of the class, or None if it has no row
+    store_token: str | None = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.gallery.nbytes
+
+
+class GalleryLRU:
+    """
+    Least-recently-used map of class id to cached gallery with a byte budget.
+
+    Memory-mapped galleries are accounted at their full array size even though
+    their pages are shared with other workers, which keeps the budget an upper
+    bound on what one worker can pin.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[int, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def get(self, class_id: int) -> _CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(class_id)
+            if entry is not None:
+                self._entries.move_to_end(class_id)
+            return entry
+
+    def put(self, class_id: int, entry: _CacheEntry) -> None:
+        with self._lock:
+            previous = self._entries.pop(class_id, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self._entries[class_id] = entry
+            self.bytes += entry.nbytes
+            # Never evict the entry just added, even if it alone exceeds the budget
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def record(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def pop(self, class_id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop(class_id, None)
+            if entry is not None:
+                self.bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+            }
+
+
+_CACHE = GalleryLRU(max_bytes=settings.FACE_GALLERY_CACHE_MAX_BYTES)
+_STORE = GalleryStore()
+
+# One loader per class at a time within this process (see ``get_gallery``).
+_LOAD_LOCKS: dict[int, threading.Lock] = {}
+_LOAD_LOCKS_GUARD = threading.Lock()
+
+
+def _load_lock(class_id: int) -> threading.Lock:
+    with _LOAD_LOCKS_GUARD:
+        return _LOAD_LOCKS.setdefault(class_id, threading.Lock())
+
+
+def _store_key(store_token: str, generation: int) -> str:
+    # The token keeps databases that share FACE_GALLERY_CACHE_DIR apart
+    return f"{store_token}-g{generation}"
+
+
+def current_generation(class_id: int) -> int:
+    generation = (
+        GalleryGeneration.objects.filter(school_class_id=class_id)
+        .values_list("generation", flat=True)
+        .first()
+    )
+    return generation or 0
+
+
+def _generation_state(class_id: int) -> tuple[int, str | None]:
+    """Return the class's ``(generation, store_token)``, creating its row on first use."""
+    rows = GalleryGeneration.objects.filter(school_class_id=class_id).values_list("generation", "store_token")
+    state = rows.first()
+    if state is None:
+        try:
+            with transaction.atomic():
+                row = GalleryGeneration.objects.create(school_class_id=class_id)
+            return row.generation, row.store_token
+        except IntegrityError:
+            # Created meanwhile by another request, or the class does not exist
+            state = rows.first()
+    return state if state is not None else (0, None)
+
+
+def bump_generation(class_id: int) -> int:
+    """Atomically increment the generation of ``class_id`` and return the new value."""
+    # The row stays locked until commit, so the read below sees our own bump.
+    with transaction.atomic():
+        updated = GalleryGeneration.objects.filter(school_class_id=class_id).update(generation=F("generation") + 1)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    GalleryGeneration.objects.create(school_class_id=class_id, generation=1)
+            except IntegrityError:
+                # Another request created the row first
+                GalleryGeneration.objects.filter(school_class_id=class_id).update(generation=F("generation") + 1)
+        return current_generation(class_id)
+
+
+def bump_generations(class_ids: Iterable[int | None]) -> None:
+    """Bump every distinct, non-null class id. For bulk writes that bypass signals."""
+    for class_id in {class_id for class_id in class_ids if class_id}:
+        bump_generation(class_id)
+
+
+def get_gallery(class_id: int) -> FaceGallery:
+    """
+    Return the gallery for ``class_id``, reloading only when its generation changed.
+
+    Loads are single-flight: while one request rebuilds a stale gallery,
+    concurrent requests for the same class are served the previous gallery,
+    or wait for the rebuild if there is nothing cached yet.
+    """
+    generation, store_token = _generation_state(class_id)
+    entry = _CACHE.get(class_id)
+    if entry is not None and entry.generation == generation:
+        _CACHE.record("hits")
+        return entry.gallery
+
+    lock = _load_lock(class_id)
+    if not lock.acquire(blocking=entry is None):
+        # Another request is already reloading this class; serve it stale.
+        _CACHE.record("stale_hits")
+        return entry.gallery
+    try:
+        entry = _CACHE.get(class_id)
+        if entry is not None and entry.generation >= generation:
+            # Reloaded by the request we were waiting on
+            _CACHE.record("hits")
+            return entry.gallery
+        _CACHE.record("misses")
+        if store_token is None:
+            gallery = recognition_service.load_known_faces_for_class(class_id)
+        else:
+            gallery = _STORE.load_or_build(
+                class_id,
+                _store_key(store_token, generation),
+                lambda: recognition_service.load_known_faces_for_class(class_id),
+            )
+        _CACHE.put(class_id, _CacheEntry(generation=generation, gallery=gallery, store_token=store_token))
+        return gallery
+    finally:
+        lock.release()
+
+
+def _apply(class_id: int, generation: int, change: Callable[[FaceGallery], FaceGallery]) -> None:
+    """Patch the cached gallery if it is exactly one generation behind, else drop it."""
+    with _load_lock(class_id):
+        entry = _CACHE.get(class_id)
+        if entry is None:
+            return
+        if entry.generation != generation - 1:
+            # We missed a change made elsewhere; the next request reloads in full.
+            _CACHE.pop(class_id)
+            return
+        try:
+            gallery = change(entry.gallery)
+        except Exception as exc:  # pragma: no cover - fall back to a full reload
+            logger.warning("Incremental gallery update failed for class %s: %s", class_id, exc)
+            _CACHE.pop(class_id)
+            return
+        _CACHE.put(class_id, _CacheEntry(generation=generation, gallery=gallery, store_token=entry.store_token))
+        if entry.store_token is not None:
+            _STORE.save(class_id, _store_key(entry.store_token, generation), gallery)
+
+
+def apply_student_change(class_id: int, generation: int, student_id: int) -> None:
+    """Replace the rows of ``student_id`` with what is currently in the database."""
+
+    def change(gallery: FaceGallery) -> FaceGallery:
+        gallery = gallery.without_student(student_id)
+        loaded = recognition_service.load_student_encodings(class_id, student_id)
+        if loaded is None:
+            return gallery
+        name, encodings = loaded
+        return gallery.with_rows(student_id, encodings, name)
+
+    _apply(class_id, generation, change)
+
+
+def apply_sample_added(class_id: int, generation: int, student_id: int, stored_encoding: bytes) -> None:
+    """Append one sample row. Idempotent, as the sample may already have been picked up."""
+    encoding = face_utils.encoding_from_bytes(stored_encoding)
+
+    def change(gallery: FaceGallery) -> FaceGallery:
+        if encoding is None or gallery.has_row(student_id, encoding):
+            return gallery
+        if student_id not in gallery.names:
+            # First row for this student; fetch their name along with everything else.
+            loaded = recognition_service.load_student_encodings(class_id, student_id)
+            if loaded is None:
+                return gallery
+            name, encodings = loaded
+            return gallery.with_rows(student_id, encodings, name)
+        return gallery.with_rows(student_id, [encoding])
+
+    _apply(class_id, generation, change)
+
+
+def apply_sample_removed(class_id: int, generation: int, student_id: int, stored_encoding: bytes) -> None:
+    encoding = face_utils.encoding_from_bytes(stored_encoding)
+
+    def change(gallery: FaceGallery) -> FaceGallery:
+        if encoding is None:
+            return gallery
+        return gallery.without_row(student_id, encoding)
+
+    _apply(class_id, generation, change)
+
+
+def cache_stats() -> dict[str, int]:
+    """Hit/miss/eviction counters and current size of this worker's gallery cache."""
+    return _CACHE.stats()
@@ -0,0 +1,160 @@
+"""
+On-disk gallery store shared by every worker process.
+
+Each class gallery is written once as a pair of ``.npy`` files (encodings and
+student ids) plus a small JSON index. Workers open the arrays with
+``np.load(mmap_mode='r')``, so the pages are shared through the OS page cache
+instead of every gunicorn worker holding its own copy, and a freshly started
+worker can serve a class without touching the database.
+
+Files are written under a temporary name and moved into place, and the index
+is written last, so readers never observe a half-written gallery.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+from django.conf import settings
+
+from .gallery import FaceGallery
+
+try:  # pragma: no cover - POSIX only
+    import fcntl
+except ImportError:  # pragma: no cover - e.g. local Windows development
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so stale files are ignored.
+STORE_FORMAT_VERSION = 1
+
+# Superseded files are only removed once they are this old, giving readers
+# that just read an older index time to open the arrays it points to.
+_STALE_FILE_AGE = 60.0
+
+
+class GalleryStore:
+    def __init__(self, root: Path | str | None = None):
+        self.root = Path(root if root is not None else settings.FACE_GALLERY_CACHE_DIR)
+
+    def _class_dir(self, class_id: int) -> Path:
+        return self.root / f"class_{int(class_id)}"
+
+    def _index_path(self, class_id: int, key: str) -> Path:
+        return self._class_dir(class_id) / f"v{STORE_FORMAT_VERSION}-{key}.json"
+
+    def load(self, class_id: int, key: str) -> FaceGallery | None:
+        """Return the stored gallery for ``key`` memory-mapped read-only, or ``None``."""
+        index_path = self._index_path(class_id, key)
+        try:
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            class_dir = index_path.parent
+            encodings = np.load(class_dir / index["encodings"], mmap_mode="r")
+            student_ids = np.load(class_dir / index["student_ids"], mmap_mode="r")
+            names = {int(pk): name for pk, name in index["names"].items()}
+            gallery = FaceGallery(encodings=encodings, student_ids=student_ids, names=names)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            logger.warning("Ignoring unreadable gallery file for class %s: %s", class_id, exc)
+            return None
+
+        if len(gallery) != index.get("rows"):
+            logger.warning("Ignoring inconsistent gallery file for class %s", class_id)
+            return None
+        return gallery
+
+    def load_or_build(self, class_id: int, key: str, build: Callable[[], FaceGallery]) -> FaceGallery:
+        """
+        Return the stored gallery for ``key``, calling ``build`` to create it if missing.
+
+        Builds are serialised per class across processes with a file lock, so
+        when several workers miss at once only the first one hits the database
+        and the others map the file it wrote.
+        """
+        gallery = self.load(class_id, key)
+        if gallery is not None:
+            return gallery
+        with self._build_lock(class_id):
+            gallery = self.load(class_id, key)
+            if gallery is None:
+                gallery = build()
+                self.save(class_id, key, gallery)
+        return gallery
+
+    @contextmanager
+    def _build_lock(self, class_id: int) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        class_dir = self._class_dir(class_id)
+        try:
+            class_dir.mkdir(parents=True, exist_ok=True)
+            handle = open(class_dir / ".build.lock", "a+b")
+        except OSError as exc:
+            logger.warning("Building gallery for class %s without a lock: %s", class_id, exc)
+            yield
+            return
+        with handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def save(self, class_id: int, key: str, gallery: FaceGallery) -> None:
+        """Persist ``gallery`` under ``key``. Failures are logged, never raised."""
+        class_dir = self._class_dir(class_id)
+        build = uuid.uuid4().hex[:12]
+        prefix = f"v{STORE_FORMAT_VERSION}-{key}-{build}"
+        try:
+            class_dir.mkdir(parents=True, exist_ok=True)
+            encodings_name = f"{prefix}.npy"
+            student_ids_name = f"{prefix}.ids.npy"
+            self._write_array(class_dir / encodings_name, gallery.encodings)
+            self._write_array(class_dir / student_ids_name, gallery.student_ids)
+            index = {
+                "class_id": int(class_id),
+                "key": key,
+                "rows": len(gallery),
+                "built_at": time.time(),
+                "encodings": encodings_name,
+                "student_ids": student_ids_name,
+                "names": {str(pk): name for pk, name in gallery.names.items()},
+            }
+            self._write_bytes(self._index_path(class_id, key), json.dumps(index).encode("utf-8"))
+        except OSError as exc:
+            logger.warning("Could not write gallery file for class %s: %s", class_id, exc)
+            return
+        self._prune(class_dir, keep=prefix)
+
+    def _write_array(self, path: Path, array: np.ndarray) -> None:
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "wb") as handle:
+            np.save(handle, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+    def _write_bytes(self, path: Path, payload: bytes) -> None:
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.write_bytes(payload)
+        os.replace(tmp_path, path)
+
+    def _prune(self, class_dir: Path, keep: str) -> None:
+        cutoff = time.time() - _STALE_FILE_AGE
+        for path in class_dir.iterdir():
+            if path.name.startswith(keep) or path.name == ".build.lock":
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                # Already removed by another worker, or still mapped on Windows.
+                continue
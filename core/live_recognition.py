@@ -0,0 +1,201 @@
+"""
+Recognizing one live frame, shared by the HTTP views and the WebSocket channel.
+
+``recognize_in_session`` admits the frame (see ``admission``), triages it,
+detects and matches faces against the class gallery, feeds the session's
+tracker and marks confirmed students present. It answers with the JSON
+response the HTTP views return; ``live_socket`` sends the same body over the
+socket. ``arecognize_in_session`` runs it from async code on a bounded
+thread pool.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.utils import timezone
+
+from . import admission, face_utils, frame_triage, gallery_cache, live_sessions, pacing, recognition_pool, recognition_service
+from .models import SchoolClass, Teacher, User
+
+RECOGNITION_UNAVAILABLE = {
+    "faces_detected": 0,
+    "matched": [],
+    "detections": [],
+    "used_face_recognition": False,
+}
+
+# Frames recognized from async code run on these threads. Beyond the threads
+# plus as many waiting frames, callers get a 429 right away.
+_ASYNC_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.FACE_ASYNC_RECOGNITION_THREADS,
+    thread_name_prefix="recognize",
+)
+_ASYNC_SLOTS = threading.BoundedSemaphore(2 * settings.FACE_ASYNC_RECOGNITION_THREADS)
+
+
+async def arecognize_in_session(
+    user: User,
+    school_class: SchoolClass,
+    image_source,
+    seq: int | None = None,
+    session: live_sessions.LiveSession | None = None,
+) -> JsonResponse:
+    """Run ``recognize_in_session`` on the async executor, or answer 429 if it is full."""
+    if not _ASYNC_SLOTS.acquire(blocking=False):
+        return busy_response(admission.retry_after_ms())
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _ASYNC_EXECUTOR,
+            closing_connections,
+            recognize_in_session,
+            user,
+            school_class,
+            image_source,
+            seq,
+            session,
+        )
+    finally:
+        _ASYNC_SLOTS.release()
+
+
+async def auser_can_access_class(user: User, school_class: SchoolClass) -> bool:
+    """Async twin of ``views._user_can_access_class``."""
+    role = getattr(user, "role", None)
+    if role == "admin":
+        return True
+    if role == "teacher":
+        return await Teacher.objects.filter(user=user, classes=school_class).aexists()
+    if role == "student":
+        return await school_class.students.filter(user=user).aexists()
+    return False
+
+
+def closing_connections(func, *args):
+    """
+    Call ``func`` between the connection cleanup the request cycle would do.
+
+    Executor threads and long-lived sockets outlive any request, so without
+    this their database connections are never checked against
+    ``CONN_MAX_AGE`` or dropped after an error.
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def recognize_in_session(
+    user: User,
+    school_class: SchoolClass,
+    image_source,
+    seq: int | None = None,
+    session: live_sessions.LiveSession | None = None,
+) -> JsonResponse:
+    # Only one frame per session at a time, and a bounded number overall, so
+    # slow recognitions answer 409/429 instead of tying up every worker
+    if session is None:
+        session = live_sessions.get_session(school_class.id, user.pk)
+    try:
+        with admission.admit(session, seq):
+            return _recognize_admitted(session, school_class, image_source)
+    except admission.Superseded:
+        return JsonResponse({"error": "Superseded by a newer frame", "superseded": True}, status=409)
+    except admission.Busy as exc:
+        # A session's own previous frame still running is not overload
+        return busy_response(exc.retry_after_ms, saturated=not isinstance(exc, admission.SessionBusy))
+
+
+def busy_response(retry_after_ms: int, saturated: bool = True) -> JsonResponse:
+    if saturated:
+        # Makes every camera back off through its pacing hints for a while
+        admission.note_rejection()
+    response = JsonResponse(
+        {"error": "Recognition is busy", "busy": True, "retry_after_ms": retry_after_ms},
+        status=429,
+    )
+    response["Retry-After"] = str(max(1, math.ceil(retry_after_ms / 1000)))
+    return response
+
+
+def _recognize_admitted(session: live_sessions.LiveSession, school_class: SchoolClass, image_source) -> JsonResponse:
+    # Decode the image using Pillow to avoid relying on cv2.imdecode. Wide
+    # JPEGs are decoded at a reduced scale; box_scale maps back to the upload.
+    try:
+        frame_rgb, box_scale = face_utils.decode_frame(image_source, settings.FACE_ENCODE_MAX_WIDTH)
+    except Exception:
+        return JsonResponse({"error": "Invalid image data"}, status=400)
+
+    now = time.monotonic()
+
+    # Skip detection for dark, blurry or unchanged frames. Unchanged frames
+    # are still processed while a face waits for its confirming frames.
+    triage = frame_triage.triage(
+        frame_rgb,
+        session.last_hash,
+        allow_duplicate=(
+            session.tracker.has_unconfirmed()
+            or now - session.last_processed >= settings.FACE_TRIAGE_MAX_SKIP_SECONDS
+        ),
+    )
+    if triage.skip_reason:
+        # Keep the previous boxes on screen for a duplicate frame
+        detections = session.last_detections if triage.skip_reason == frame_triage.SKIP_DUPLICATE else []
+        return JsonResponse({
+            "faces_detected": len(detections),
+            "matched": [],
+            "detections": detections,
+            "used_face_recognition": True,
+            "skipped": triage.skip_reason,
+            "pacing": pacing.pacing_hint(session.all_present),
+        })
+
+    # Get known faces for the class
+    today = timezone.localdate()
+    gallery = gallery_cache.get_gallery(school_class.id)
+
+    # Find matches, reusing the identity of faces tracked from previous frames
+    detections = recognition_service.find_matches_in_frame(
+        frame_rgb,
+        gallery,
+        reuse_boxes=session.tracker.reusable_boxes(now),
+        reuse_iou=session.tracker.iou_threshold,
+        detect_width=settings.FACE_DETECT_WIDTH,
+        box_scale=box_scale,
+        detector=recognition_pool.detect_and_encode,
+    )
+    detections = session.tracker.update(detections, now)
+    session.last_hash = triage.frame_hash
+    session.last_processed = now
+    session.last_detections = detections
+
+    # Get a list of matched student IDs and their confidence, only once a
+    # face has been matched to the same student on several frames
+    matched_students_with_confidence = [
+        (d["student_id"], 1 - d["metric"]) 
+        for d in detections 
+        if d["confirmed"] and d["student_id"] and d["metric"] is not None
+    ]
+    matched_student_ids = {d[0] for d in matched_students_with_confidence}
+
+    # Mark attendance in the database
+    if matched_students_with_confidence:
+        recognition_service.mark_attendance_for_matches(matched_students_with_confidence, school_class.id)
+    session.all_present = recognition_service.everyone_present(school_class.id, gallery, today)
+
+    return JsonResponse({
+        "faces_detected": len(detections),
+        "matched": list(matched_student_ids),
+        "detections": detections,
+        "used_face_recognition": True,
+        "skipped": None,
+        "pacing": pacing.pacing_hint(session.all_present),
+    })
@@ -0,0 +1,63 @@
+"""
+Per-worker state for live attendance sessions.
+
+A session is one user capturing frames for one class. It holds the state that
+should survive between frames, such as the face tracker and what the last
+processed frame looked like (see ``frame_triage``). Sessions that stop
+sending frames are dropped after ``FACE_SESSION_IDLE_SECONDS``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from .face_tracking import FaceTracker
+
+
+def _new_tracker() -> FaceTracker:
+    return FaceTracker(
+        confirm_frames=settings.FACE_TRACK_CONFIRM_FRAMES,
+        reverify_seconds=settings.FACE_TRACK_REVERIFY_SECONDS,
+        iou_threshold=settings.FACE_TRACK_IOU_THRESHOLD,
+    )
+
+
+@dataclass
+class LiveSession:
+    class_id: int
+    user_id: int
+    tracker: FaceTracker = field(default_factory=_new_tracker)
+    last_seen: float = field(default_factory=time.monotonic)
+    # Hash, time and detections of the last frame that went through detection
+    last_hash: int | None = None
+    last_processed: float = 0.0
+    last_detections: list[dict] = field(default_factory=list)
+    # No student with an encoding was left to recognize on the last frame
+    all_present: bool = False
+    # Admission state for when the shared session files are unavailable, see
+    # ``admission.SessionGates``. ``busy`` is set while a frame of this
+    # session is being processed.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    busy: bool = False
+    latest_seq: int = 0
+
+
+_SESSIONS: dict[tuple[int, int], LiveSession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(class_id: int, user_id: int) -> LiveSession:
+    """Return the live session for ``(class_id, user_id)``, creating it if needed."""
+    now = time.monotonic()
+    with _SESSIONS_LOCK:
+        idle_cutoff = now - settings.FACE_SESSION_IDLE_SECONDS
+        for key in [key for key, session in _SESSIONS.items() if session.last_seen < idle_cutoff]:
+            del _SESSIONS[key]
+        session = _SESSIONS.get((class_id, user_id))
+        if session is None:
+            session = _SESSIONS[(class_id, user_id)] = LiveSession(class_id=class_id, user_id=user_id)
+        session.last_seen = now
+        return session
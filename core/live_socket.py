@@ -0,0 +1,192 @@
+"""
+WebSocket channel for live attendance, served straight from the ASGI app.
+
+Over HTTP every frame pays for the session and auth middleware, the CSRF
+check and the class lookup and access check. A camera that connects to
+``/core/ws/live/?class_id=<id>`` does all of that once, during the handshake.
+After that each binary message is one JPEG frame. The reply is a text
+message with the same JSON as ``recognize_frame_upload``, including the
+detections and the ids of students just marked present.
+
+The connection owns its ``LiveSession``, so the tracker and the triage state
+live exactly as long as the socket. If frames arrive faster than they can be
+recognized, only the newest waiting frame is kept.
+
+There is no Channels dependency: ``config/asgi.py`` routes ``websocket``
+scopes to ``application`` below and everything else to Django.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import logging
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+
+from . import face_utils, live_recognition
+from .live_sessions import LiveSession
+from .models import SchoolClass
+
+logger = logging.getLogger(__name__)
+
+PATH = "/core/ws/live/"
+
+# Close codes sent before the handshake is accepted (the client sees a 403)
+_CLOSE_NOT_FOUND = 4404
+_CLOSE_UNAUTHORIZED = 4401
+_CLOSE_FORBIDDEN = 4403
+
+
+def _headers(scope) -> dict[str, str]:
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+
+
+def _origin_allowed(origin: str | None, host: str | None) -> bool:
+    """
+    Same-origin browsers only; non-browser clients send no Origin and still need a session.
+
+    Like Django's CSRF check, the Origin must name the host (and port) the
+    handshake was sent to, or be one of ``CSRF_TRUSTED_ORIGINS``.
+    """
+    if not origin:
+        return True
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    origin_host = urlsplit(origin).netloc.lower()
+    if not origin_host or not host or origin_host != host.lower():
+        return False
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+async def _authenticate(headers: dict[str, str]):
+    cookies = SimpleCookie()
+    cookies.load(headers.get("cookie", ""))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = await aget_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+async def application(scope, receive, send) -> None:
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+
+    # The handshake's async ORM queries run on the shared sync thread, so
+    # clean up its connections around them as the request cycle would.
+    # Frames are recognized through ``live_recognition.closing_connections``.
+    await sync_to_async(close_old_connections)()
+    try:
+        connection = await _accept(scope, send)
+    finally:
+        await sync_to_async(close_old_connections)()
+    if connection is not None:
+        await connection.run(receive)
+
+
+async def _accept(scope, send) -> _LiveConnection | None:
+    """Check the handshake and accept it, or close the socket and return ``None``."""
+    if scope.get("path") != PATH:
+        await send({"type": "websocket.close", "code": _CLOSE_NOT_FOUND})
+        return None
+
+    headers = _headers(scope)
+    if not _origin_allowed(headers.get("origin"), headers.get("host")):
+        await send({"type": "websocket.close", "code": _CLOSE_FORBIDDEN})
+        return None
+
+    user = await _authenticate(headers)
+    if user is None:
+        await send({"type": "websocket.close", "code": _CLOSE_UNAUTHORIZED})
+        return None
+
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        class_id = int(query.get("class_id", [""])[0])
+    except ValueError:
+        await send({"type": "websocket.close", "code": _CLOSE_NOT_FOUND})
+        return None
+    school_class = await SchoolClass.objects.filter(id=class_id).afirst()
+    if school_class is None:
+        await send({"type": "websocket.close", "code": _CLOSE_NOT_FOUND})
+        return None
+    if not await live_recognition.auser_can_access_class(user, school_class):
+        await send({"type": "websocket.close", "code": _CLOSE_FORBIDDEN})
+        return None
+
+    await send({"type": "websocket.accept"})
+    return _LiveConnection(user, school_class, send)
+
+
+class _LiveConnection:
+    def __init__(self, user, school_class: SchoolClass, send):
+        self.user = user
+        self.school_class = school_class
+        self.send = send
+        self.session = LiveSession(class_id=school_class.id, user_id=user.pk)
+        self.pending: bytes | None = None
+        self.frame_ready = asyncio.Event()
+        self.closed = False
+
+    async def run(self, receive) -> None:
+        worker = asyncio.create_task(self._process_frames())
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                frame = message.get("bytes")
+                if frame is None:
+                    # Text messages are reserved for control messages
+                    continue
+                max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+                if max_size is not None and len(frame) > max_size:
+                    await self._reply({"error": "Frame too large"})
+                    continue
+                # Latest frame wins: replace one that has not been picked up yet
+                self.pending = frame
+                self.frame_ready.set()
+        finally:
+            self.closed = True
+            self.frame_ready.set()
+            await worker
+
+    async def _process_frames(self) -> None:
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            if self.closed:
+                return
+            frame, self.pending = self.pending, None
+            if frame is None:
+                continue
+            if not face_utils.FACE_RECOGNITION_AVAILABLE:
+                await self._reply(live_recognition.RECOGNITION_UNAVAILABLE)
+                continue
+            try:
+                response = await live_recognition.arecognize_in_session(
+                    self.user, self.school_class, io.BytesIO(frame), session=self.session
+                )
+            except Exception:
+                logger.exception("Live recognition failed for class %s", self.school_class.id)
+                await self._reply({"error": "Recognition failed"})
+                continue
+            await self._reply(response.content.decode("utf-8"))
+
+    async def _reply(self, payload) -> None:
+        if self.closed:
+            return
+        text = payload if isinstance(payload, str) else json.dumps(payload)
+        await self.send({"type": "websocket.send", "text": text})
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from core import encoding_cache, face_utils
+from core.models import FaceSample
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Compute and store face encodings for uploaded face samples that do not have one yet."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Recalculate encodings even if one already exists.",
+        )
+        parser.add_argument(
+            "--student",
+            type=str,
+            help="Limit the backfill to one student's samples. Accepts primary key or username.",
+        )
+
+    def handle(self, *args, **options):
+        force: bool = options["force"]
+        student_filter: str | None = options.get("student")
+
+        if not face_utils.FACE_RECOGNITION_AVAILABLE:
+            self.stdout.write(self.style.ERROR("face_recognition library is not installed."))
+            return
+
+        queryset = FaceSample.objects.select_related("student__user").order_by("pk")
+        if student_filter:
+            if student_filter.isdigit():
+                queryset = queryset.filter(student_id=int(student_filter))
+            else:
+                queryset = queryset.filter(student__user__username=student_filter)
+
+        processed = 0
+        encoded = 0
+        skipped = 0
+        unchanged = 0
+
+        for sample in queryset.iterator():
+            processed += 1
+
+            if sample.encoding and not force:
+                skipped += 1
+                continue
+
+            try:
+                data, source_hash = encoding_cache.read_image(sample.image)
+            except FileNotFoundError:
+                self.stdout.write(self.style.WARNING(f"Missing image file for sample {sample.pk}: {sample.image.name}"))
+                skipped += 1
+                continue
+            except Exception as exc:  # pragma: no cover - safety net
+                logger.warning("Failed reading face sample %s: %s", sample.pk, exc)
+                skipped += 1
+                continue
+
+            if sample.encoding and encoding_cache.is_current(
+                source_hash, sample.encoding_source_hash, sample.encoding_version
+            ):
+                # Same image and encoder as the stored encoding
+                unchanged += 1
+                continue
+
+            result = encoding_cache.encode_bytes(data, source_hash)
+
+            if not result.encoding:
+                if result.readable:
+                    self.stdout.write(self.style.WARNING(f"No face detected in sample {sample.pk} for {sample.student}."))
+                skipped += 1
+                continue
+
+            sample.encoding = result.encoding
+            sample.encoding_source_hash = result.source_hash
+            sample.encoding_version = result.version
+            with transaction.atomic():
+                sample.save(update_fields=["encoding", "encoding_source_hash", "encoding_version"])
+            encoded += 1
+            self.stdout.write(self.style.SUCCESS(f"Stored encoding for sample {sample.pk} ({sample.student})."))
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"Processed {processed} sample(s): {encoded} encoded, {unchanged} unchanged, {skipped} skipped"
+            )
+        )
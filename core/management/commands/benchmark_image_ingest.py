@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import io
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db.models import Q
+
+from core import face_utils
+from core.models import Student
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+MODES = (("full", False), ("fast", True))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the full-decode and the fast (JPEG draft) paths of face_utils.image_to_array "
+        "on decode time and peak memory."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            type=Path,
+            help="Image files or directories to use (default: student photos from the database).",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=50,
+            help="Use at most this many images (default: 50).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Time each image this many times and keep the fastest run (default: 3).",
+        )
+        parser.add_argument(
+            "--max-side",
+            type=int,
+            default=face_utils.IMAGE_MAX_SIDE,
+            help=f"Long side images are reduced to (default: {face_utils.IMAGE_MAX_SIDE}).",
+        )
+        parser.add_argument(
+            "--compare-encodings",
+            action="store_true",
+            help="Also encode every image both ways and report how far apart the encodings are.",
+        )
+
+    def handle(self, *args, **options):
+        limit: int = max(1, options["limit"])
+        repeat: int = max(1, options["repeat"])
+        max_side: int = options["max_side"]
+
+        images = self._load_images(options["paths"], limit)
+        if not images:
+            raise CommandError("No images found.")
+        megapixels = statistics.mean(width * height for _, (width, height), _ in images) / 1e6
+        self.stdout.write(f"{len(images)} image(s), {megapixels:.1f} MP on average, reduced to {max_side} px\n")
+
+        results = {}
+        for mode, fast in MODES:
+            results[mode] = self._measure(images, fast, max_side, repeat)
+
+        self.stdout.write(f"{'path':<6}{'ms/image':>10}{'decoded MB':>12}{'numpy peak MB':>15}")
+        for mode, _ in MODES:
+            ms, decoded_mb, peak_mb = results[mode]
+            self.stdout.write(f"{mode:<6}{ms:>10.1f}{decoded_mb:>12.1f}{peak_mb:>15.1f}")
+        full, fast = results["full"], results["fast"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"fast path: {full[0] / fast[0]:.1f}x faster, "
+                f"{full[1] / fast[1]:.1f}x less decoded image memory per photo"
+            )
+        )
+        self.stdout.write(
+            "decoded MB is the largest bitmap Pillow decodes (not visible to tracemalloc); "
+            "numpy peak MB is the tracemalloc peak while converting."
+        )
+
+        if options["compare_encodings"]:
+            self._compare_encodings(images, max_side)
+
+    def _load_images(self, paths: list[Path], limit: int) -> list[tuple[str, tuple[int, int], bytes]]:
+        """Read the images into memory up front so storage I/O is not timed."""
+        sources = []
+        if paths:
+            for path in paths:
+                if path.is_dir():
+                    sources.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES))
+                else:
+                    sources.append(path)
+            sources = sources[:limit]
+            raw = [(str(path), path.read_bytes()) for path in sources]
+        else:
+            raw = []
+            students = Student.objects.exclude(Q(photo="") | Q(photo__isnull=True)).defer("face_encodings")
+            for student in students.order_by("pk")[:limit]:
+                try:
+                    with student.photo.open("rb") as handle:
+                        raw.append((student.photo.name, handle.read()))
+                except FileNotFoundError:
+                    self.stdout.write(self.style.WARNING(f"Missing photo file for {student}: {student.photo.name}"))
+
+        images = []
+        for name, data in raw:
+            try:
+                size = face_utils.open_for_encoding(io.BytesIO(data), fast=False).size
+            except Exception:
+                self.stdout.write(self.style.WARNING(f"Skipping {name}: not a readable image."))
+                continue
+            images.append((name, size, data))
+        return images
+
+    def _measure(self, images, fast: bool, max_side: int, repeat: int) -> tuple[float, float, float]:
+        """Return (ms per image, mean decoded MB, mean numpy peak MB)."""
+        timings = []
+        for _, _, data in images:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                face_utils.image_to_array(io.BytesIO(data), max_side=max_side, fast=fast)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+
+        decoded = []
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _, _, data in images:
+                image = face_utils.open_for_encoding(io.BytesIO(data), max_side, fast)
+                decoded.append(image.width * image.height * len(image.getbands()))
+                tracemalloc.reset_peak()
+                face_utils.image_to_array(io.BytesIO(data), max_side=max_side, fast=fast)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+        return (
+            statistics.mean(timings) * 1000,
+            statistics.mean(decoded) / 2**20,
+            statistics.mean(peaks) / 2**20,
+        )
+
+    def _compare_encodings(self, images, max_side: int) -> None:
+        if not face_utils.FACE_RECOGNITION_AVAILABLE:
+            self.stdout.write(self.style.WARNING("face_recognition is not installed; skipping the encoding comparison."))
+            return
+        distances = []
+        for name, _, data in images:
+            encodings = []
+            for _, fast in MODES:
+                array = face_utils.image_to_array(io.BytesIO(data), max_side=max_side, fast=fast)
+                encodings.append(face_utils.extract_first_encoding(array) if array is not None else None)
+            if any(encoding is None for encoding in encodings):
+                self.stdout.write(self.style.WARNING(f"{name}: no face found by one of the paths."))
+                continue
+            distances.append(float(np.linalg.norm(encodings[0] - encodings[1])))
+        if distances:
+            self.stdout.write(
+                f"Encoding distance between paths over {len(distances)} face(s): "
+                f"mean {statistics.mean(distances):.4f}, max {max(distances):.4f} "
+                f"(live matching uses a tolerance of 0.4)"
+            )
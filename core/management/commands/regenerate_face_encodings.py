@@ -1,16 +1,89 @@
 from __future__ import annotations
 
+import json
 import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandParser
 from django.db import transaction
+from django.db.models import Q
 
-from core import face_utils
+from core import encoding_cache, face_utils, gallery_cache, recognition_pool
 from core.models import Student
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHECKPOINT = Path(settings.BASE_DIR) / ".cache" / "regenerate_face_encodings.json"
+
+
+def _encode_photo(job: tuple[int, str, str, str]) -> tuple[int, encoding_cache.EncodingResult | None, str]:
+    """
+    Look up or compute the encoding of one student photo.
+
+    Runs in pool processes, so it only gets the primary key, the file name and
+    the hash and version of the stored encoding, and opens the file through
+    the field's storage. Returns ``(pk, result or None, outcome)`` where
+    outcome is ``"ok"``, ``"unchanged"``, ``"missing"``, ``"unreadable"``,
+    ``"no_face"`` or ``"timed_out"``.
+    """
+    pk, name, stored_hash, stored_version = job
+    storage = Student._meta.get_field("photo").storage
+    try:
+        with storage.open(name, "rb") as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        return pk, None, "missing"
+    except Exception as exc:  # pragma: no cover - safety net
+        logger.warning("Failed reading photo for %s: %s", pk, exc)
+        return pk, None, "unreadable"
+
+    source_hash = encoding_cache.content_hash(data)
+    if encoding_cache.is_current(source_hash, stored_hash, stored_version):
+        return pk, None, "unchanged"
+
+    result = encoding_cache.encode_bytes(data, source_hash)
+    if not result.readable:
+        return pk, None, "unreadable"
+    if not result.encoding:
+        return pk, result, "timed_out" if result.timed_out else "no_face"
+    return pk, result, "ok"
+
+
+def _map_in_window(executor: Executor, func: Callable, jobs: Iterable, window: int) -> Iterator:
+    """
+    Like ``executor.map(func, jobs)``, but reads ``jobs`` only as workers free up.
+
+    ``Executor.map`` consumes the whole iterable up front, so every student
+    would be loaded before the first photo is encoded. Here at most
+    ``window`` jobs are queued or running at once, and each finished job lets
+    another in. Results are still yielded in submission order.
+    """
+    jobs = iter(jobs)
+    submitted: deque[Future] = deque()
+    running: set[Future] = set()
+    exhausted = False
+    while True:
+        while not exhausted and len(running) < window:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                break
+            future = executor.submit(func, job)
+            submitted.append(future)
+            running.add(future)
+        if not submitted:
+            return
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        running -= done
+        while submitted and submitted[0].done():
+            yield submitted.popleft().result()
+
 
 class Command(BaseCommand):
     help = "Regenerate face encodings for students whose photos are present."
@@ -19,75 +92,196 @@ class Command(BaseCommand):
         parser.add_argument(
             "--force",
             action="store_true",
-            help="Recalculate encodings even if one already exists.",
+            help="Recalculate encodings even if one already exists. Photos whose content and "
+            "encoder version match the stored encoding are still skipped.",
         )
         parser.add_argument(
             "--student",
             type=str,
             help="Limit regeneration to a specific student. Accepts primary key or username.",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Decode and encode photos in this many processes (default: 1, no pool).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Write encodings to the database in batches of this many students (default: 100).",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted run from its checkpoint instead of starting over.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            default=DEFAULT_CHECKPOINT,
+            help=f"Checkpoint file used by --resume (default: {DEFAULT_CHECKPOINT}).",
+        )
 
     def handle(self, *args, **options):
         force: bool = options["force"]
         student_filter: str | None = options.get("student")
+        workers: int = max(1, options["workers"])
+        batch_size: int = max(1, options["batch_size"])
+        checkpoint: Path = options["checkpoint"]
 
         if not face_utils.FACE_RECOGNITION_AVAILABLE:
             self.stdout.write(self.style.ERROR("face_recognition library is not installed."))
             return
 
-        queryset = Student.objects.select_related("user")
+        queryset = Student.objects.select_related("user").defer("face_encodings").order_by("pk")
         if student_filter:
             if student_filter.isdigit():
                 queryset = queryset.filter(pk=int(student_filter))
             else:
                 queryset = queryset.filter(user__username=student_filter)
+        if not force:
+            queryset = queryset.filter(has_encoding=False)
+
+        run_key = {"force": force, "student": student_filter}
+        # A single student needs no resume point, and must not overwrite or
+        # delete the one an interrupted full run left at the same path
+        use_checkpoint = not student_filter
+        if options["resume"]:
+            state = self._read_checkpoint(checkpoint)
+            if state is None or state.get("run") != run_key:
+                self.stdout.write(self.style.WARNING("No matching checkpoint found; starting from the beginning."))
+            else:
+                queryset = queryset.filter(pk__gt=state["last_pk"])
+                self.stdout.write(f"Resuming after student {state['last_pk']}.")
 
+        without_photo = Q(photo="") | Q(photo__isnull=True)
+        no_photo = list(queryset.filter(without_photo))
+        for student in no_photo:
+            self.stdout.write(self.style.WARNING(f"Skipping {student} – no photo available."))
+        skipped = len(no_photo)
+        queryset = queryset.exclude(without_photo)
+
+        total = queryset.count()
         processed = 0
         regenerated = 0
-        skipped = 0
-
-        for student in queryset.iterator():
-            processed += 1
-
-            if not student.photo:
-                self.stdout.write(self.style.WARNING(f"Skipping {student} – no photo available."))
-                skipped += 1
-                continue
-
-            if student.face_encodings and not force:
-                skipped += 1
-                continue
-
-            try:
-                with student.photo.open("rb") as handle:
-                    image_array = face_utils.image_to_array(handle)
-            except FileNotFoundError:
-                self.stdout.write(self.style.WARNING(f"Missing photo file for {student}: {student.photo.name}"))
-                skipped += 1
-                continue
-            except Exception as exc:  # pragma: no cover - safety net
-                logger.warning("Failed reading photo for %s: %s", student.pk, exc)
-                skipped += 1
-                continue
-
-            if image_array is None:
-                skipped += 1
-                continue
-
-            encoding = face_utils.extract_first_encoding(image_array)
-            if encoding is None:
-                self.stdout.write(self.style.WARNING(f"No face detected for {student}."))
-                skipped += 1
-                continue
-
-            student.face_encodings = encoding.tolist()
-            with transaction.atomic():
-                student.save(update_fields=["face_encodings"])
-            regenerated += 1
-            self.stdout.write(self.style.SUCCESS(f"Updated face encoding for {student}."))
+        unchanged = 0
+        cached = 0
+        # stage -> [runs, seconds, faces found]
+        stage_stats: dict[str, list] = {name: [0, 0.0, 0] for name, *_ in face_utils.DETECTION_STAGES}
+        started = time.monotonic()
+
+        students: dict[int, Student] = {}
+        pending: list[Student] = []
+
+        def jobs():
+            for student in queryset.iterator(chunk_size=batch_size):
+                students[student.pk] = student
+                # Only a stored encoding can be unchanged
+                stored_hash = student.encoding_source_hash if student.has_encoding else ""
+                yield student.pk, student.photo.name, stored_hash, student.encoding_version
+
+        def flush(last_pk: int | None) -> None:
+            if pending:
+                with transaction.atomic():
+                    Student.objects.bulk_update(
+                        pending, ["face_encodings", "has_encoding", "encoding_source_hash", "encoding_version"]
+                    )
+                    # bulk_update bypasses the signals that keep class galleries fresh
+                    gallery_cache.bump_generations(student.school_class_id for student in pending)
+                pending.clear()
+            if last_pk is not None and use_checkpoint:
+                self._write_checkpoint(checkpoint, {"run": run_key, "last_pk": last_pk})
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed else 0.0
+            remaining = (total - processed) / rate if rate else 0.0
+            self.stdout.write(
+                f"{processed}/{total} student(s), {rate:.1f} students/s, about {remaining:.0f}s left"
+            )
+
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=recognition_pool.init_worker,
+                initargs=(1,),
+            )
+            results = _map_in_window(executor, _encode_photo, jobs(), window=workers * 2)
+        else:
+            results = map(_encode_photo, jobs())
+
+        try:
+            # Results come back in primary key order, so after each batch every
+            # student up to the last one is done and can be checkpointed
+            last_pk = None
+            for pk, result, outcome in results:
+                student = students.pop(pk)
+                processed += 1
+                last_pk = pk
+                if result is not None:
+                    cached += result.cached
+                    for stage, seconds in result.timings:
+                        stats = stage_stats[stage]
+                        stats[0] += 1
+                        stats[1] += seconds
+                        stats[2] += stage == result.stage
+                if outcome == "ok":
+                    student.face_encodings = result.encoding
+                    student.has_encoding = True
+                    student.encoding_source_hash = result.source_hash
+                    student.encoding_version = result.version
+                    pending.append(student)
+                    regenerated += 1
+                elif outcome == "unchanged":
+                    unchanged += 1
+                else:
+                    skipped += 1
+                    if outcome == "missing":
+                        self.stdout.write(self.style.WARNING(f"Missing photo file for {student}: {student.photo.name}"))
+                    elif outcome == "no_face":
+                        self.stdout.write(self.style.WARNING(f"No face detected for {student}."))
+                    elif outcome == "timed_out":
+                        self.stdout.write(
+                            self.style.WARNING(f"No face detected for {student} within the time budget.")
+                        )
+                if processed % batch_size == 0:
+                    flush(last_pk)
+            if processed % batch_size:
+                flush(last_pk)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
+        if use_checkpoint and (self._read_checkpoint(checkpoint) or {}).get("run") == run_key:
+            checkpoint.unlink()
+
+        elapsed = time.monotonic() - started
         self.stdout.write(
             self.style.MIGRATE_HEADING(
-                f"Processed {processed} student(s): {regenerated} regenerated, {skipped} skipped"
+                f"Processed {processed + len(no_photo)} student(s): {regenerated} regenerated, {unchanged} unchanged, "
+                f"{skipped} skipped "
+                f"in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} students/s)"
             )
         )
+
+        for stage, (runs, seconds, found) in stage_stats.items():
+            if runs:
+                self.stdout.write(
+                    f"  {stage}: {runs} image(s), {seconds / runs:.2f}s each on average, found a face in {found}"
+                )
+        if cached:
+            self.stdout.write(f"  {cached} encoding(s) reused from the encoding cache")
+
+    def _read_checkpoint(self, path: Path) -> dict | None:
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write_checkpoint(self, path: Path, state: dict) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state), encoding="utf-8")
+        tmp_path.replace(path)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import logging
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import close_old_connections
+
+from core import encoding_jobs, face_utils
+from core.models import EncodingJob
+
+logger = logging.getLogger(__name__)
+
+# Jobs only count as stale after FACE_ENCODING_JOB_TIMEOUT_SECONDS, so looking
+# for them on every poll of an empty queue would be wasted queries
+STALE_CHECK_INTERVAL = 60.0
+
+
+class Command(BaseCommand):
+    help = "Encode queued student photos and face samples. Run one or more alongside the web processes."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking an empty queue again (default: 2).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        if not face_utils.FACE_RECOGNITION_AVAILABLE:
+            raise CommandError("face_recognition library is not installed.")
+
+        poll_interval: float = options["poll_interval"]
+        self._stopping = False
+
+        def stop(*_):
+            # Finish the job in hand, then exit
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        requeued = encoding_jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Recovered {requeued} job(s) left running by a stopped worker."))
+        self.stdout.write(self.style.SUCCESS("Encoding worker started."))
+        last_stale_check = time.monotonic()
+
+        processed = 0
+        while not self._stopping:
+            close_old_connections()
+            job = encoding_jobs.claim_next()
+            if job is None:
+                if options["once"]:
+                    break
+                if time.monotonic() - last_stale_check >= STALE_CHECK_INTERVAL:
+                    encoding_jobs.requeue_stale()
+                    last_stale_check = time.monotonic()
+                time.sleep(poll_interval)
+                continue
+
+            started = time.monotonic()
+            status = encoding_jobs.run(job)
+            processed += 1
+            message = f"{job} finished in {time.monotonic() - started:.1f}s"
+            if status == EncodingJob.DONE:
+                self.stdout.write(self.style.SUCCESS(message))
+            else:
+                self.stdout.write(self.style.WARNING(f"{message}: {job.error or job.get_status_display()}"))
+
+        self.stdout.write(f"Encoding worker stopped after {processed} job(s).")
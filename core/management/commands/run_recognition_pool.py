@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import sys
+import threading
+from multiprocessing.connection import Listener
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from core import face_utils, recognition_pool
+from core.admission import Busy
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve face detection and encoding for live recognition from a pool of processes. "
+        "Point web workers at it with FACE_RECOGNITION_POOL_ADDRESS."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--address",
+            type=str,
+            default=settings.FACE_RECOGNITION_POOL_ADDRESS or "127.0.0.1:8765",
+            help="host:port or Unix socket path to listen on (default: FACE_RECOGNITION_POOL_ADDRESS).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.FACE_RECOGNITION_WORKERS or os.cpu_count() or 1,
+            help="Number of recognition processes (default: FACE_RECOGNITION_WORKERS, else one per CPU).",
+        )
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            default=None,
+            help="Frames allowed to wait for a free process before callers are told to retry "
+            "(default: FACE_RECOGNITION_QUEUE_SIZE).",
+        )
+        parser.add_argument(
+            "--allow-remote",
+            action="store_true",
+            help="Allow listening on an address other machines can reach. Connections are not "
+            "encrypted and anyone with FACE_RECOGNITION_POOL_AUTHKEY can run code in the pool.",
+        )
+
+    def handle(self, *args, **options):
+        if not face_utils.FACE_RECOGNITION_AVAILABLE:
+            raise CommandError("face_recognition library is not installed.")
+        if not settings.FACE_RECOGNITION_POOL_AUTHKEY:
+            raise CommandError("FACE_RECOGNITION_POOL_AUTHKEY is not set.")
+        if settings.SECRET_KEY == "dev-insecure-secret-key":
+            raise CommandError("DJANGO_SECRET_KEY is still the development default; set it before starting the pool.")
+        address = recognition_pool.parse_address(options["address"])
+        if not options["allow_remote"] and not recognition_pool.is_local_address(address):
+            raise CommandError(
+                f"{options['address']} is not a loopback address or Unix socket; pass --allow-remote to listen on it."
+            )
+
+        workers: int = options["workers"]
+        queue_size = options["queue_size"]
+        if queue_size is None:
+            queue_size = settings.FACE_RECOGNITION_QUEUE_SIZE
+        pool = recognition_pool.RecognitionPool(
+            workers=workers,
+            queue_size=queue_size,
+            threads_per_worker=settings.FACE_RECOGNITION_THREADS_PER_WORKER,
+        )
+
+        if isinstance(address, str) and os.path.exists(address):
+            # Left over from a previous run
+            os.unlink(address)
+
+        listener = Listener(address, authkey=recognition_pool.authkey())
+        # Stop the pool processes too when the process manager stops us
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recognition pool listening on {options['address']} with {workers} worker(s), "
+                f"queue size {queue_size}."
+            )
+        )
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as exc:  # e.g. a client with the wrong key
+                    logger.warning("Rejected recognition pool connection: %s", exc)
+                    continue
+                threading.Thread(target=self._serve, args=(pool, connection), daemon=True).start()
+        except KeyboardInterrupt:
+            self.stdout.write("Shutting down recognition pool.")
+        finally:
+            listener.close()
+            pool.shutdown()
+
+    def _serve(self, pool: recognition_pool.RecognitionPool, connection) -> None:
+        """Answer one web worker's frames, one at a time, until it disconnects."""
+        with connection:
+            while True:
+                try:
+                    job = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", pool.run(job, timeout=settings.FACE_RECOGNITION_TIMEOUT_SECONDS))
+                except Busy as exc:
+                    reply = ("busy", exc.retry_after_ms)
+                except Exception as exc:
+                    logger.exception("Recognition job failed")
+                    reply = ("error", str(exc))
+                try:
+                    connection.send(reply)
+                except (EOFError, OSError):
+                    return
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_manualexcuselog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facesample',
+            name='encoding',
+            field=models.JSONField(blank=True, default=list, help_text='Auto-generated from the sample image when it is uploaded.'),
+        ),
+    ]
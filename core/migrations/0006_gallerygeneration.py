@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_facesample_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleryGeneration',
+            fields=[
+                ('school_class', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='gallery_generation', serialize=False, to='core.schoolclass')),
+                ('generation', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,91 @@
+import numpy as np
+from django.db import migrations, models
+
+ENCODING_DTYPE = np.dtype("<f4")
+
+
+def _to_bytes(value):
+    if not value:
+        return b""
+    try:
+        return np.asarray(value, dtype=ENCODING_DTYPE).tobytes()
+    except (TypeError, ValueError):
+        return b""
+
+
+def _to_list(value):
+    if not value:
+        return []
+    return np.frombuffer(value, dtype=ENCODING_DTYPE).astype(float).tolist()
+
+
+def _convert(apps, source, target, convert):
+    Student = apps.get_model('core', 'Student')
+    FaceSample = apps.get_model('core', 'FaceSample')
+    for model, field in ((Student, 'face_encodings'), (FaceSample, 'encoding')):
+        batch = []
+        for obj in model.objects.only('pk', f'{field}{source}').iterator():
+            setattr(obj, f'{field}{target}', convert(getattr(obj, f'{field}{source}')))
+            batch.append(obj)
+            if len(batch) >= 500:
+                model.objects.bulk_update(batch, [f'{field}{target}'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [f'{field}{target}'])
+
+
+def json_to_binary(apps, schema_editor):
+    _convert(apps, '', '_binary', _to_bytes)
+
+
+def binary_to_json(apps, schema_editor):
+    _convert(apps, '_binary', '', _to_list)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_gallerygeneration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='face_encodings_binary',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='facesample',
+            name='encoding_binary',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='student',
+            name='face_encodings',
+        ),
+        migrations.RemoveField(
+            model_name='facesample',
+            name='encoding',
+        ),
+        migrations.RenameField(
+            model_name='student',
+            old_name='face_encodings_binary',
+            new_name='face_encodings',
+        ),
+        migrations.RenameField(
+            model_name='facesample',
+            old_name='encoding_binary',
+            new_name='encoding',
+        ),
+        migrations.AlterField(
+            model_name='student',
+            name='face_encodings',
+            field=models.BinaryField(blank=True, default=b'', help_text='Auto-generated from the main photo if face_recognition is installed. Stored as 128 float32 values.'),
+        ),
+        migrations.AlterField(
+            model_name='facesample',
+            name='encoding',
+            field=models.BinaryField(blank=True, default=b'', help_text='Auto-generated from the sample image when it is uploaded. Stored as 128 float32 values.'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:38
+
+from django.db import migrations, models
+
+
+def populate_has_encoding(apps, schema_editor):
+    Student = apps.get_model('core', 'Student')
+    Student.objects.exclude(face_encodings=b'').update(has_encoding=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_binary_face_encodings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='has_encoding',
+            field=models.BooleanField(db_index=True, default=False, editable=False, help_text='Kept in sync with face_encodings so list views can skip loading it.'),
+        ),
+        migrations.RunPython(populate_has_encoding, migrations.RunPython.noop),
+    ]
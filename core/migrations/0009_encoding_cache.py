@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_student_has_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facesample',
+            name='encoding_source_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the image the encoding was computed from.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='facesample',
+            name='encoding_version',
+            field=models.CharField(blank=True, editable=False, help_text='Encoder configuration the encoding was computed with.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='encoding_source_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the photo the encoding was computed from.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='encoding_version',
+            field=models.CharField(blank=True, editable=False, help_text='Encoder configuration the encoding was computed with.', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='EncodingCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('encoder_version', models.CharField(max_length=64)),
+                ('encoding', models.BinaryField(blank=True, default=b'', help_text='Empty when no face was found in the image.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'encoder_version')},
+            },
+        ),
+    ]
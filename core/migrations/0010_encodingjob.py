@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_encoding_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncodingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Queued'), ('running', 'Encoding'), ('done', 'Encoded'), ('no_face', 'No face found'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('sample', models.ForeignKey(blank=True, help_text="Empty for the student's main photo.", null=True, on_delete=django.db.models.deletion.CASCADE, related_name='encoding_jobs', to='core.facesample')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='encoding_jobs', to='core.student')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:34
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_encodingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gallerygeneration',
+            name='store_token',
+            field=models.CharField(default=core.models._new_store_token, editable=False, max_length=32),
+        ),
+    ]
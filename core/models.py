@@ -1,4 +1,5 @@
 from __future__ import annotations
+import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
@@ -55,7 +56,10 @@ class Student(models.Model):
     school_class = models.ForeignKey(SchoolClass, on_delete=models.SET_NULL, null=True, blank=True, related_name='students')
     roll_number = models.CharField(max_length=20, blank=True)
     photo = models.ImageField(upload_to='students/', blank=True, null=True, help_text="A single, high-quality frontal face shot for the main profile.")
-    face_encodings = models.JSONField(default=list, blank=True, help_text="Auto-generated from the main photo if face_recognition is installed.")
+    face_encodings = models.BinaryField(default=b"", blank=True, help_text="Auto-generated from the main photo if face_recognition is installed. Stored as 128 float32 values.")
+    has_encoding = models.BooleanField(default=False, db_index=True, editable=False, help_text="Kept in sync with face_encodings so list views can skip loading it.")
+    encoding_source_hash = models.CharField(max_length=64, blank=True, editable=False, help_text="SHA-256 of the photo the encoding was computed from.")
+    encoding_version = models.CharField(max_length=64, blank=True, editable=False, help_text="Encoder configuration the encoding was computed with.")
 
     class Meta:
         unique_together = ('school_class', 'roll_number')
@@ -63,6 +67,15 @@ class Student(models.Model):
     def __str__(self) -> str:
         return self.get_full_name()
 
+    def save(self, *args, **kwargs):
+        # Keep has_encoding in sync, unless face_encodings was deferred and is not being written
+        if "face_encodings" not in self.get_deferred_fields():
+            self.has_encoding = bool(self.face_encodings)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "face_encodings" in update_fields:
+                kwargs["update_fields"] = {*update_fields, "has_encoding"}
+        super().save(*args, **kwargs)
+
     def get_full_name(self) -> str:
         return self.user.get_full_name() or self.user.username
 
@@ -70,11 +83,70 @@ class FaceSample(models.Model):
     """Stores multiple face clippings for a student to improve recognition accuracy."""
     student = models.ForeignKey(Student, related_name='samples', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='face_samples/')
+    encoding = models.BinaryField(default=b"", blank=True, help_text="Auto-generated from the sample image when it is uploaded. Stored as 128 float32 values.")
+    encoding_source_hash = models.CharField(max_length=64, blank=True, editable=False, help_text="SHA-256 of the image the encoding was computed from.")
+    encoding_version = models.CharField(max_length=64, blank=True, editable=False, help_text="Encoder configuration the encoding was computed with.")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
         return f"Sample for {self.student.get_full_name()} at {self.created_at.strftime('%Y-%m-%d %H:%M')}"
 
+class EncodingCache(models.Model):
+    """Face encodings by image content and encoder version, so an image is only ever encoded once."""
+    content_hash = models.CharField(max_length=64)
+    encoder_version = models.CharField(max_length=64)
+    encoding = models.BinaryField(default=b"", blank=True, help_text="Empty when no face was found in the image.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('content_hash', 'encoder_version')
+
+    def __str__(self) -> str:
+        return f"Encoding cache {self.content_hash[:12]} ({self.encoder_version})"
+
+class EncodingJob(models.Model):
+    """A student photo or face sample waiting to be encoded by ``manage.py run_encoding_worker``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    NO_FACE = 'no_face'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Queued'),
+        (RUNNING, 'Encoding'),
+        (DONE, 'Encoded'),
+        (NO_FACE, 'No face found'),
+        (FAILED, 'Failed'),
+    )
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='encoding_jobs')
+    sample = models.ForeignKey(FaceSample, on_delete=models.CASCADE, null=True, blank=True, related_name='encoding_jobs', help_text="Empty for the student's main photo.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        target = f"sample {self.sample_id}" if self.sample_id else "photo"
+        return f"Encoding job {self.pk} for student {self.student_id} {target} ({self.status})"
+
+def _new_store_token() -> str:
+    return uuid.uuid4().hex
+
+
+class GalleryGeneration(models.Model):
+    """Per-class counter bumped whenever the class's face gallery changes."""
+    school_class = models.OneToOneField(SchoolClass, on_delete=models.CASCADE, primary_key=True, related_name='gallery_generation')
+    generation = models.PositiveBigIntegerField(default=0)
+    # Random per row, so gallery files written for another database (or before
+    # a reset) that happen to share the class id and generation never match
+    store_token = models.CharField(max_length=32, default=_new_store_token, editable=False)
+
+    def __str__(self) -> str:
+        return f"{self.school_class} gallery generation {self.generation}"
+
 class AttendanceRecord(models.Model):
     STATUS_CHOICES = (
         ('present', 'Present'),
@@ -0,0 +1,42 @@
+"""
+Pacing hints for the live capture loop.
+
+Every recognition response tells the client how long to wait before the next
+frame and how large and how compressed that frame should be. When the server
+is idle, cameras send frequent, sharp frames. As recognition slots fill up
+(several classes taking attendance at once), every camera backs off and sends
+smaller frames, so capacity is shared without anyone being turned away. Once
+every student with an encoding is present, there is little left to
+recognize and the camera slows right down.
+"""
+from __future__ import annotations
+
+from django.conf import settings
+
+from . import admission
+
+
+def pacing_hint(all_present: bool = False) -> dict[str, int | float]:
+    """Return ``interval_ms``, ``max_width`` and ``jpeg_quality`` for the next frame."""
+    load = admission.load()
+
+    min_interval = settings.FACE_PACING_MIN_INTERVAL_MS
+    max_interval = settings.FACE_PACING_MAX_INTERVAL_MS
+    if all_present:
+        interval = max_interval
+    else:
+        # Never ask for frames faster than they are processed, and stretch
+        # the interval up to threefold as the slots fill up
+        interval = max(min_interval, 1.2 * admission.average_frame_ms()) * (1 + 2 * load)
+    interval = min(max_interval, interval)
+
+    max_width = settings.FACE_PACING_MAX_WIDTH
+    min_width = settings.FACE_PACING_MIN_WIDTH
+    width = max_width - (max_width - min_width) * load
+
+    return {
+        "interval_ms": int(interval),
+        # Multiples of 16 keep JPEG blocks aligned
+        "max_width": int(width) // 16 * 16,
+        "jpeg_quality": round(0.8 - 0.2 * load, 2),
+    }
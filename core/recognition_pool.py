@@ -0,0 +1,226 @@
+"""
+Executor for the CPU-bound part of live recognition: face detection and encoding.
+
+dlib detection and encoding would otherwise run inside the web worker that
+received the frame, tying the number of recognitions that can run at once to
+``WEB_CONCURRENCY``. ``detect_and_encode`` here is a drop-in for
+``recognition_service.detect_and_encode`` that runs it in one of three ways:
+
+- ``FACE_RECOGNITION_POOL_ADDRESS`` set: sent to a shared pool served by
+  ``manage.py run_recognition_pool``, so every web worker and every ASGI
+  process feeds the same, separately sized set of processes;
+- ``FACE_RECOGNITION_WORKERS`` > 0: a process pool owned by this web process,
+  handy for ``runserver`` or a single ASGI process;
+- otherwise inline in the request thread, as before.
+
+Pools have a bounded queue: a frame that finds ``FACE_RECOGNITION_QUEUE_SIZE``
+frames already waiting raises ``admission.Busy`` instead of queueing. Pool
+processes limit BLAS/OpenMP to ``FACE_RECOGNITION_THREADS_PER_WORKER``
+threads each so that N workers use about N cores, not N times every core.
+
+The shared pool authenticates callers with ``FACE_RECOGNITION_POOL_AUTHKEY``
+and, unless told otherwise, only listens on loopback or a Unix socket:
+``multiprocessing.connection`` unpickles what it receives.
+
+Matching against the class gallery stays in the web process: it is cheap, and
+the galleries are already cached there.
+"""
+from __future__ import annotations
+
+import hashlib
+import ipaddress
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .admission import Busy, retry_after_ms
+
+logger = logging.getLogger(__name__)
+
+_THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def init_worker(threads: int) -> None:
+    """
+    Process pool initializer: cap native thread pools, then set up Django.
+
+    The variables only take effect if set before numpy is first imported, so
+    they are set here, before ``django.setup()``, rather than in the parent:
+    this module must not import numpy itself. Pools use the ``spawn`` start
+    method so that the child starts without it. Explicit settings in the
+    environment are left alone.
+    """
+    for name in _THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+
+    import django
+
+    django.setup()
+    try:
+        import cv2
+
+        cv2.setNumThreads(threads)
+    except Exception:  # pragma: no cover - cv2 is optional
+        pass
+
+
+def _detect_and_encode_job(frame_rgb, reuse_boxes, iou_threshold, detect_width, box_scale):
+    from . import recognition_service
+
+    return recognition_service.detect_and_encode(frame_rgb, reuse_boxes, iou_threshold, detect_width, box_scale)
+
+
+class RecognitionPool:
+    """Process pool with a bounded number of running plus queued jobs."""
+
+    def __init__(self, workers: int, queue_size: int, threads_per_worker: int = 1):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, queue_size))
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(self.threads_per_worker,),
+                )
+            return self._executor
+
+    def run(self, args: tuple, timeout: float | None = None):
+        """Run one detect-and-encode job and return its result, or raise ``Busy``."""
+        if not self._slots.acquire(blocking=False):
+            raise Busy(retry_after_ms())
+        try:
+            future = self._get_executor().submit(_detect_and_encode_job, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard_executor()
+            raise
+        # The slot is only free once the job really finishes, even if we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            raise Busy(retry_after_ms()) from None
+        except BrokenProcessPool:
+            self._discard_executor()
+            raise
+
+    def _discard_executor(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        self._discard_executor()
+
+
+def parse_address(value: str):
+    """``host:port`` for TCP, anything else (e.g. ``/run/recognition.sock``) is a Unix socket path."""
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit() and "/" not in value:
+        return (host or "127.0.0.1", int(port))
+    return value.removeprefix("unix:")
+
+
+def is_local_address(address) -> bool:
+    """Whether a ``parse_address`` result can only be reached from this machine."""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def authkey() -> bytes:
+    """
+    Shared secret for the pool connection, from ``FACE_RECOGNITION_POOL_AUTHKEY``.
+
+    ``multiprocessing.connection`` unpickles whatever an authenticated peer
+    sends, so anyone holding this key can run code in the pool and in the web
+    processes. Raises ``ImproperlyConfigured`` when it is not set.
+    """
+    key = settings.FACE_RECOGNITION_POOL_AUTHKEY
+    if not key:
+        raise ImproperlyConfigured("FACE_RECOGNITION_POOL_AUTHKEY must be set to use the recognition pool.")
+    return hashlib.sha256(f"recognition-pool:{key}".encode()).digest()
+
+
+_LOCAL_POOL: RecognitionPool | None = None
+_LOCAL_POOL_LOCK = threading.Lock()
+_CONNECTIONS = threading.local()
+
+
+def _local_pool() -> RecognitionPool:
+    global _LOCAL_POOL
+    with _LOCAL_POOL_LOCK:
+        if _LOCAL_POOL is None:
+            _LOCAL_POOL = RecognitionPool(
+                workers=settings.FACE_RECOGNITION_WORKERS,
+                queue_size=settings.FACE_RECOGNITION_QUEUE_SIZE,
+                threads_per_worker=settings.FACE_RECOGNITION_THREADS_PER_WORKER,
+            )
+        return _LOCAL_POOL
+
+
+def _run_remote(args: tuple):
+    connection = getattr(_CONNECTIONS, "connection", None)
+    if connection is None:
+        connection = Client(parse_address(settings.FACE_RECOGNITION_POOL_ADDRESS), authkey=authkey())
+        _CONNECTIONS.connection = connection
+    try:
+        connection.send(args)
+        if not connection.poll(settings.FACE_RECOGNITION_TIMEOUT_SECONDS):
+            raise Busy(retry_after_ms())
+        status, payload = connection.recv()
+    except BaseException:
+        # The reply, if any, would be read by the next frame; start afresh
+        _CONNECTIONS.connection = None
+        connection.close()
+        raise
+    if status == "busy":
+        raise Busy(payload)
+    if status == "error":
+        raise RuntimeError(payload)
+    return payload
+
+
+def detect_and_encode(frame_rgb, reuse_boxes=(), iou_threshold=0.4, detect_width=None, box_scale=1.0):
+    """Same as ``recognition_service.detect_and_encode``, run where the settings say."""
+    args = (frame_rgb, tuple(reuse_boxes), iou_threshold, detect_width, box_scale)
+    if settings.FACE_RECOGNITION_POOL_ADDRESS:
+        try:
+            return _run_remote(args)
+        except (OSError, EOFError) as exc:
+            # Keep recognition working while the pool is down or restarting
+            logger.warning("Recognition pool unavailable, running inline: %s", exc)
+    elif settings.FACE_RECOGNITION_WORKERS > 0:
+        try:
+            return _local_pool().run(args, timeout=settings.FACE_RECOGNITION_TIMEOUT_SECONDS)
+        except BrokenProcessPool as exc:
+            logger.warning("Recognition pool crashed, running inline: %s", exc)
+    return _detect_and_encode_job(*args)
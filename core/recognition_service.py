@@ -6,144 +6,316 @@ try:
 except Exception:
     face_recognition = None  # type: ignore
 
+try:
+    import cv2  # optional, used for fast resizing
+except Exception:
+    cv2 = None  # type: ignore
+
+import threading
+import time
+
 import numpy as np
-from . import face_utils
-from .models import Student, FaceSample, AttendanceRecord, SchoolClass, AcademicYear
+from PIL import Image
+from . import face_tracking, face_utils
+from .gallery import ENCODING_DIMENSIONS, FaceGallery
+from .models import Student, FaceSample, AttendanceRecord, SchoolClass
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Prefetch
+
+def _sample_encodings_prefetch():
+    return Prefetch("samples", queryset=FaceSample.objects.only("id", "student_id", "encoding"))
 
-def load_known_faces_for_class(class_id: int):
+def load_known_faces_for_class(class_id: int) -> FaceGallery:
     """
-    Load all known face encodings for a given class.
+    Load all known face encodings for a given class as one gallery matrix.
     This improves accuracy by using multiple samples per student.
-    """
-    known_face_encodings = []
-    known_face_metadata = []
 
+    Sample encodings are computed once at upload time (see ``signals.py`` and
+    the ``backfill_sample_encodings`` command), so this is a pure DB read.
+    """
     try:
         school_class = SchoolClass.objects.get(id=class_id)
-        students = school_class.students.all()
     except SchoolClass.DoesNotExist:
-        return [], []
+        return FaceGallery.empty()
 
-    # If face_recognition isn't available, skip loading encodings from images.
+    # If face_recognition isn't available, no frame can be matched anyway.
     if face_recognition is None:
-        return [], []
+        return FaceGallery.empty()
 
+    students = school_class.students.select_related("user").prefetch_related(_sample_encodings_prefetch())
+
+    rows = []
+    names = {}
     for student in students:
-        # Use the primary face encoding first if it exists
-        if student.face_encodings:
-            try:
-                known_face_encodings.append(np.array(student.face_encodings))
-                known_face_metadata.append({"student_id": student.pk, "name": student.get_full_name()})
-            except (ValueError, TypeError):
-                continue # Skip if encoding is invalid
-
-        # Then add encodings from all face samples
-        for sample in student.samples.all():
-            try:
-                with sample.image.open('rb') as handle:
-                    image_array = face_utils.image_to_array(handle)
-            except FileNotFoundError:
-                continue
-
-            if image_array is None:
-                continue
-
-            encoding = face_utils.extract_first_encoding(image_array)
-            if encoding is None:
-                continue
-
-            known_face_encodings.append(encoding)
-            known_face_metadata.append({"student_id": student.pk, "name": student.get_full_name()})
-                
-    return known_face_encodings, known_face_metadata
-
-def find_matches_in_frame(frame_rgb, known_face_encodings, known_face_metadata, tolerance=0.4):
+        names[student.pk] = student.get_full_name()
+        rows.extend((student.pk, encoding) for encoding in _stored_encodings(student))
+
+    return FaceGallery.from_rows(rows, names)
+
+def load_student_encodings(class_id: int, student_id: int):
+    """
+    Return ``(name, encodings)`` for one student of a class, or ``None`` if the
+    student is no longer in that class. Used for incremental gallery updates.
+    """
+    student = (
+        Student.objects.select_related("user")
+        .prefetch_related(_sample_encodings_prefetch())
+        .filter(pk=student_id, school_class_id=class_id)
+        .first()
+    )
+    if student is None:
+        return None
+    return student.get_full_name(), _stored_encodings(student)
+
+def _stored_encodings(student):
+    # Use the primary face encoding first if it exists, then the samples.
+    # Stored encodings are decoded as zero-copy float32 views.
+    stored = [student.face_encodings]
+    stored.extend(sample.encoding for sample in student.samples.all())
+    decoded = (face_utils.encoding_from_bytes(data) for data in stored)
+    return [encoding for encoding in decoded if encoding is not None]
+
+def detect_faces(frame_rgb, detect_width=None):
+    """
+    Return face locations in ``frame_rgb`` coordinates.
+
+    HOG detection cost grows with the pixel count, so frames wider than
+    ``detect_width`` are detected on a downscaled copy and the boxes are mapped
+    back to the full-resolution frame.
+    """
+    height, width = frame_rgb.shape[:2]
+    if not detect_width or width <= detect_width:
+        return face_recognition.face_locations(frame_rgb)
+
+    scale = detect_width / width
+    small_size = (detect_width, max(1, round(height * scale)))
+    if cv2 is not None:
+        small = cv2.resize(frame_rgb, small_size, interpolation=cv2.INTER_AREA)
+    else:
+        small = np.asarray(Image.fromarray(frame_rgb).resize(small_size, Image.Resampling.BILINEAR, reducing_gap=2.0))
+
+    return [
+        (
+            max(0, round(top / scale)),
+            min(width, round(right / scale)),
+            min(height, round(bottom / scale)),
+            max(0, round(left / scale)),
+        )
+        for top, right, bottom, left in face_recognition.face_locations(small)
+    ]
+
+def _scale_box(box, factor):
+    if factor == 1:
+        return tuple(box)
+    return tuple(round(value * factor) for value in box)
+
+def detect_and_encode(frame_rgb, reuse_boxes=(), iou_threshold=0.4, detect_width=None, box_scale=1.0):
+    """
+    Detect faces and compute encodings for those that need one.
+
+    Detection runs at ``detect_width`` (see ``detect_faces``) while encodings
+    use the full-resolution frame. Returned boxes are multiplied by
+    ``box_scale`` so they are in the coordinates of the frame the client sent,
+    which is also how ``reuse_boxes`` are expressed.
+
+    Faces overlapping one of ``reuse_boxes`` (confirmed tracks from the
+    previous frames) get ``None`` instead of an encoding, which skips the
+    expensive 128-d encoding step for them.
+    """
+    frame_locations = detect_faces(frame_rgb, detect_width)
+    face_locations = [_scale_box(location, box_scale) for location in frame_locations]
+    to_encode = [
+        index
+        for index, location in enumerate(face_locations)
+        if face_tracking.best_overlap(location, reuse_boxes, iou_threshold) is None
+    ]
+    encodings = [None] * len(face_locations)
+    if to_encode:
+        computed = face_recognition.face_encodings(frame_rgb, [frame_locations[index] for index in to_encode])
+        for index, encoding in zip(to_encode, computed):
+            encodings[index] = encoding
+    return face_locations, encodings
+
+def match_encodings(face_locations, encodings, gallery: FaceGallery, tolerance=0.4):
+    """
+    Match the encoded faces of a frame against the class gallery.
+
+    All faces are matched in a single batched distance computation. Faces are
+    always matched against the full gallery, students already present
+    included: a face within tolerance of an absent lookalike belongs to
+    whoever is nearest. Faces without an encoding are returned as ``reused``.
+    """
+    encoded = [index for index, encoding in enumerate(encodings) if encoding is not None]
+    probes = np.asarray([encodings[index] for index in encoded], dtype=np.float32).reshape(len(encoded), ENCODING_DIMENSIONS)
+
+    student_ids, distances = gallery.match(probes, tolerance)
+
+    results = dict(zip(encoded, zip(student_ids.tolist(), distances.tolist())))
+    detected_faces = []
+    for index, face_location in enumerate(face_locations):
+        top, right, bottom, left = face_location
+        detection = {
+            "box": [top, right, bottom, left],
+            "metric": None,
+            "student_id": None,
+            "name": "Unknown",
+            "reused": index not in results,
+        }
+        if index in results:
+            student_id, distance = results[index]
+            detection["metric"] = None if np.isnan(distance) else distance
+            if student_id != -1:
+                detection["student_id"] = student_id
+                detection["name"] = gallery.names.get(student_id, "Unknown")
+        detected_faces.append(detection)
+
+    return detected_faces
+
+def find_matches_in_frame(
+    frame_rgb,
+    gallery: FaceGallery,
+    tolerance=0.4,
+    reuse_boxes=(),
+    reuse_iou=0.4,
+    detect_width=None,
+    box_scale=1.0,
+    detector=None,
+):
     """
     Recognizes faces in a single video frame and returns match data.
     Does NOT modify the database.
+
+    See ``detect_and_encode`` for ``reuse_boxes``, ``detect_width`` and
+    ``box_scale``. ``detector``
+    replaces ``detect_and_encode``, e.g. to run it in a process pool.
     """
     # If face_recognition isn't available, no detections can be made
     if face_recognition is None:
         return []
 
-    # Find all the faces and face encodings in the current frame of video
-    face_locations = face_recognition.face_locations(frame_rgb)
-    face_encodings = face_recognition.face_encodings(frame_rgb, face_locations)
-    
-    detected_faces = []
+    detector = detector or detect_and_encode
+    face_locations, encodings = detector(frame_rgb, reuse_boxes, reuse_iou, detect_width, box_scale)
+    return match_encodings(face_locations, encodings, gallery, tolerance)
 
-    for face_encoding, face_location in zip(face_encodings, face_locations):
-        # See if the face is a match for the known face(s)
-        matches = face_recognition.compare_faces(known_face_encodings, face_encoding, tolerance=tolerance)
-        
-        # Use the best match
-        face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-        
-        best_match_index = np.argmin(face_distances) if len(face_distances) > 0 else -1
-        
-        top, right, bottom, left = face_location
-        detection_result = {
-            "box": [top, right, bottom, left],
-            "metric": float(face_distances[best_match_index]) if best_match_index != -1 else None,
-            "student_id": None,
-            "name": "Unknown"
-        }
+# Students already marked present, per class, for the current day. Seeded
+# from the database and updated on every mark, so repeat frames of students
+# who are already present cost no queries. Status changes made by other
+# workers (a teacher excusing a student, an admin deleting a record) only
+# reach this worker through the database, so the set is re-read once it is
+# FACE_PRESENT_SET_TTL_SECONDS old.
+_PRESENT_SETS = {}
+_PRESENT_SETS_LOCK = threading.Lock()
 
-        if best_match_index != -1 and matches[best_match_index]:
-            metadata = known_face_metadata[best_match_index]
-            detection_result["student_id"] = metadata["student_id"]
-            detection_result["name"] = metadata["name"]
+def present_student_ids(class_id, day):
+    """Return the (shared, mutable) set of student ids present in ``class_id`` on ``day``."""
+    now = time.monotonic()
+    with _PRESENT_SETS_LOCK:
+        entry = _PRESENT_SETS.get(class_id)
+        if entry is not None and entry[0] == day and now - entry[2] < settings.FACE_PRESENT_SET_TTL_SECONDS:
+            return entry[1]
 
-        detected_faces.append(detection_result)
-            
-    return detected_faces
+    present = set(
+        AttendanceRecord.objects.filter(
+            school_class_id=class_id,
+            date=day,
+            status="present",
+        ).values_list("student_id", flat=True)
+    )
+    with _PRESENT_SETS_LOCK:
+        entry = _PRESENT_SETS.get(class_id)
+        if entry is not None and entry[0] == day and entry[2] >= now:
+            # Reloaded concurrently; keep the set other requests already hold
+            entry[1].update(present)
+            return entry[1]
+        _PRESENT_SETS[class_id] = (day, present, now)
+    return present
+
+def forget_present(class_id, day, student_id):
+    """Drop a student from this worker's present set; other workers catch up within the TTL."""
+    with _PRESENT_SETS_LOCK:
+        entry = _PRESENT_SETS.get(class_id)
+        if entry is not None and entry[0] == day:
+            entry[1].discard(student_id)
+
+def everyone_present(class_id, gallery: FaceGallery, day) -> bool:
+    """Whether every student with an encoding in ``gallery`` is present on ``day``."""
+    return present_student_ids(class_id, day).issuperset(np.unique(gallery.student_ids).tolist())
 
-@transaction.atomic
 def mark_attendance_for_matches(matched_students, class_id):
     """
-    Mark attendance for a list of student IDs for a specific class.
+    Mark attendance for a list of ``(student_id, confidence)`` pairs in a class.
     Avoids duplicate entries for the same day.
+
+    Students already in the class's present set are filtered out first, so a
+    frame that only re-recognizes present students does not touch the database.
     """
-    today = timezone.now().date()
-    try:
-        school_class = SchoolClass.objects.get(id=class_id)
-        active_academic_year = school_class.academic_year
-    except SchoolClass.DoesNotExist:
+    today = timezone.localdate()
+    present = present_student_ids(class_id, today)
+    pending = [(student_id, confidence) for student_id, confidence in matched_students if student_id not in present]
+    if not pending:
         return 0
 
-    if not active_academic_year:
-        return 0 # No active academic year found for this class
+    marked_ids, created_count = _upsert_attendance(pending, class_id, today)
+    with _PRESENT_SETS_LOCK:
+        present.update(marked_ids)
+    return created_count
+
+@transaction.atomic
+def _upsert_attendance(matched_students, class_id, today):
+    """
+    Write ``present`` records and return ``(present_student_ids, created_count)``.
+
+    Runs a fixed number of queries however many students matched: one for the
+    class members, one for today's records and a single upsert against the
+    ``(student, school_class, date)`` unique constraint, which also absorbs
+    concurrent frames marking the same student.
+    """
+    school_class = SchoolClass.objects.filter(id=class_id).only("id", "academic_year_id").first()
+    if school_class is None:
+        return set(), 0
+
+    if not school_class.academic_year_id:
+        return set(), 0 # No active academic year found for this class
 
-    marked_count = 0
+    # Keep the best confidence per student
+    best_confidence = {}
     for student_id, confidence in matched_students:
-        try:
-            student = Student.objects.get(pk=student_id)
-        except Student.DoesNotExist:
-            continue
-
-        # Ensure student is actually in the class
-        if student not in school_class.students.all():
-            continue
-
-        # Get or create the record
-        record, created = AttendanceRecord.objects.get_or_create(
-            student=student,
+        if confidence > best_confidence.get(student_id, float("-inf")):
+            best_confidence[student_id] = confidence
+
+    # Ensure students are actually in the class
+    member_ids = set(
+        school_class.students.filter(pk__in=best_confidence.keys()).values_list("pk", flat=True)
+    )
+    existing_status = dict(
+        AttendanceRecord.objects.filter(
             school_class=school_class,
             date=today,
-            academic_year=active_academic_year,
-            defaults={'status': 'present', 'confidence': confidence}
-        )
+            student_id__in=member_ids,
+        ).values_list("student_id", "status")
+    )
 
-        # If record already existed but wasn't 'present', update it.
-        if not created and record.status != 'present':
-            record.status = 'present'
-            record.confidence = confidence
-            record.save()
-        
-        if created:
-            marked_count += 1
-            
-    return marked_count
+    # Create missing records and flip existing non-present ones to present
+    records = [
+        AttendanceRecord(
+            student_id=student_id,
+            school_class=school_class,
+            date=today,
+            academic_year_id=school_class.academic_year_id,
+            status="present",
+            confidence=best_confidence[student_id],
+        )
+        for student_id in member_ids
+        if existing_status.get(student_id) != "present"
+    ]
+    if records:
+        AttendanceRecord.objects.bulk_create(
+            records,
+            update_conflicts=True,
+            unique_fields=["student", "school_class", "date"],
+            update_fields=["status", "confidence"],
+        )
 
+    return member_ids, sum(1 for record in records if record.student_id not in existing_status)
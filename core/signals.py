@@ -1,35 +1,131 @@
 import logging
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from . import face_utils
-from .models import Student
+from . import encoding_cache, encoding_jobs, gallery_cache
+from .models import FaceSample, Student, User
 
 
 logger = logging.getLogger(__name__)
 
+# Encoding takes seconds, so saves only queue it for run_encoding_worker
+# (see encoding_jobs.py). Jobs are created after the save, which already
+# wrote the image file, and are visible to the worker once the transaction commits.
+
+@receiver(post_save, sender=Student)
+def enqueue_encoding_on_save(sender, instance: Student, created, raw=False, **kwargs):
+    if raw or not instance.photo or instance.has_encoding:
+        return
+    encoding_jobs.enqueue(instance.pk)
+
+
+@receiver(post_save, sender=FaceSample)
+def enqueue_sample_encoding_on_save(sender, instance: FaceSample, created, raw=False, **kwargs):
+    if raw or not instance.image or instance.encoding:
+        return
+    encoding_jobs.enqueue(instance.student_id, instance.pk)
+
+
+@receiver(post_delete, sender=Student)
+def forget_cached_photo_encoding(sender, instance: Student, **kwargs):
+    encoding_cache.forget(instance.encoding_source_hash)
+
+
+@receiver(post_delete, sender=FaceSample)
+def forget_cached_sample_encoding(sender, instance: FaceSample, **kwargs):
+    encoding_cache.forget(instance.encoding_source_hash)
+
+
+# --- Gallery invalidation -------------------------------------------------
+# Each change bumps the generation of the affected class(es) right away and,
+# once the transaction commits, patches this worker's cached gallery.
+
+_GALLERY_FIELDS = {"school_class", "face_encodings"}
+
+
+def _bump_and_apply(class_id, apply, *args):
+    generation = gallery_cache.bump_generation(class_id)
+    transaction.on_commit(lambda: apply(class_id, generation, *args))
+
+
+def _student_class_id(student_id):
+    return Student.objects.filter(pk=student_id).values_list("school_class_id", flat=True).first()
+
+
+@receiver(pre_save, sender=Student)
+def remember_previous_class(sender, instance: Student, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and "school_class" not in update_fields:
+        return
+    instance._gallery_previous_class_id = _student_class_id(instance.pk)
+
+
 @receiver(post_save, sender=Student)
-def generate_encoding_on_save(sender, instance: Student, created, **kwargs):
-    if not instance.photo or not face_utils.FACE_RECOGNITION_AVAILABLE:
+def refresh_gallery_on_student_save(sender, instance: Student, raw=False, update_fields=None, **kwargs):
+    if raw:
         return
-    if instance.face_encodings:
+    if update_fields is not None and not _GALLERY_FIELDS.intersection(update_fields):
         return
-    try:
-        with instance.photo.open('rb') as f:
-            image_array = face_utils.image_to_array(f)
-            if image_array is None:
-                return
-    except FileNotFoundError:
-        logger.warning("Photo file missing while generating encoding for student %s", instance.pk)
+    class_ids = {instance.school_class_id}
+    if update_fields is None or "school_class" in update_fields:
+        class_ids.add(instance.__dict__.pop("_gallery_previous_class_id", None))
+    for class_id in class_ids - {None}:
+        _bump_and_apply(class_id, gallery_cache.apply_student_change, instance.pk)
+
+
+@receiver(post_delete, sender=Student)
+def refresh_gallery_on_student_delete(sender, instance: Student, **kwargs):
+    if instance.school_class_id:
+        _bump_and_apply(instance.school_class_id, gallery_cache.apply_student_change, instance.pk)
+
+
+# Gallery rows carry the student's display name (see Student.get_full_name)
+_NAME_FIELDS = ("first_name", "last_name", "username")
+
+
+def _user_names(user_id):
+    return User.objects.filter(pk=user_id).values_list(*_NAME_FIELDS).first()
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_name(sender, instance: User, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
         return
-    except Exception as exc:  # pragma: no cover - best effort
-        logger.warning("Failed generating face encoding for student %s: %s", instance.pk, exc)
+    if update_fields is not None and not set(_NAME_FIELDS).intersection(update_fields):
         return
+    instance._gallery_previous_names = _user_names(instance.pk)
+
 
-    encoding = face_utils.extract_first_encoding(image_array)
-    if encoding is None:
-        logger.info("No face encodings detected for student %s", instance.pk)
+@receiver(post_save, sender=User)
+def refresh_gallery_on_rename(sender, instance: User, raw=False, **kwargs):
+    previous = instance.__dict__.pop("_gallery_previous_names", None)
+    if raw or previous is None or previous == tuple(getattr(instance, name) for name in _NAME_FIELDS):
         return
+    class_id = _student_class_id(instance.pk)
+    if class_id:
+        _bump_and_apply(class_id, gallery_cache.apply_student_change, instance.pk)
+
+
+@receiver(post_save, sender=FaceSample)
+def refresh_gallery_on_sample_save(sender, instance: FaceSample, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and "encoding" not in update_fields:
+        return
+    class_id = _student_class_id(instance.student_id)
+    if not class_id:
+        return
+    if created:
+        _bump_and_apply(class_id, gallery_cache.apply_sample_added, instance.student_id, instance.encoding)
+    else:
+        # The previous encoding is unknown, so re-read the student's rows
+        _bump_and_apply(class_id, gallery_cache.apply_student_change, instance.student_id)
+
 
-    instance.face_encodings = encoding.tolist()
-    instance.save(update_fields=["face_encodings"])
+@receiver(post_delete, sender=FaceSample)
+def refresh_gallery_on_sample_delete(sender, instance: FaceSample, **kwargs):
+    class_id = _student_class_id(instance.student_id)
+    if class_id:
+        _bump_and_apply(class_id, gallery_cache.apply_sample_removed, instance.student_id, instance.encoding)
@@ -10,6 +10,8 @@ urlpatterns = [
     path('teacher/attendance/live/', views.take_attendance_entry, name='take_attendance_entry'),
     path('teacher/class/<int:class_id>/take/', views.take_attendance, name='take_attendance'),
     path('api/recognize/', views.recognize_frame, name='recognize_frame'),
+    path('api/recognize/frame/', views.recognize_frame_upload, name='recognize_frame_upload'),
+    path('api/recognize/frame/async/', views.recognize_frame_async, name='recognize_frame_async'),
     path('api/diagnostics/', views.class_diagnostics, name='class_diagnostics'),
     path('api/attendance/summary/', views.attendance_summary_api, name='attendance_summary_api'),
     path('api/attendance/student/<int:student_id>/history/', views.attendance_student_history_api, name='attendance_student_history_api'),
@@ -4,7 +4,7 @@ import io
 import json
 from datetime import date
 from django.urls import reverse
-import time
+from django.conf import settings
 
 from django.contrib import messages
 from django.contrib.auth import login, logout
@@ -26,7 +26,6 @@ from django.db.models import Prefetch
 from .forms import CustomSignUpForm, StudentForm, FaceSampleForm, CustomLoginForm
 from .models import AttendanceRecord, SchoolClass, Student, Teacher, User, FaceSample, AcademicYear, ManualExcuseLog
 
-from PIL import Image
 try:
     import numpy as np
     import cv2
@@ -39,10 +38,7 @@ try:
 except Exception:
     face_recognition = None
 
-from . import recognition_service
-
-# In-memory cache for known faces per class to avoid reloading on every request
-_RECOGNITION_CACHE: dict[int, dict] = {}
+from . import gallery_cache, live_recognition, recognition_service
 
 
 def _classes_for_user(user: User):
@@ -75,7 +71,9 @@ def _user_can_access_class(user: User, school_class: SchoolClass) -> bool:
 
 def _attendance_snapshot(school_class: SchoolClass, target_date: date) -> list[dict]:
     students = list(
-        school_class.students.select_related("user").order_by("roll_number", "user__first_name", "user__last_name")
+        school_class.students.select_related("user")
+        .defer("face_encodings")
+        .order_by("roll_number", "user__first_name", "user__last_name")
     )
     records = {
         record.student_id: record
@@ -83,7 +81,7 @@ def _attendance_snapshot(school_class: SchoolClass, target_date: date) -> list[d
             school_class=school_class,
             date=target_date,
             academic_year=school_class.academic_year,
-        ).select_related("student__user")
+        )
     }
     snapshot = []
     for student in students:
@@ -102,28 +100,6 @@ def _attendance_snapshot(school_class: SchoolClass, target_date: date) -> list[d
     return snapshot
 
 
-def _get_known_faces_for_class(class_id: int) -> tuple[list, list]:
-    """
-    Get known faces from cache or load them if cache is stale or missing.
-    """
-    now = time.time()
-    entry = _RECOGNITION_CACHE.get(class_id)
-    
-    # Reuse cache if it's less than 30 seconds old
-    if entry and now - entry.get("loaded_at", 0) < 30:
-        return entry.get("known_face_encodings"), entry.get("known_face_metadata")
-
-    # Load from service
-    known_face_encodings, known_face_metadata = recognition_service.load_known_faces_for_class(class_id)
-    
-    _RECOGNITION_CACHE[class_id] = {
-        "loaded_at": now,
-        "known_face_encodings": known_face_encodings,
-        "known_face_metadata": known_face_metadata,
-    }
-    return known_face_encodings, known_face_metadata
-
-
 def home(request: HttpRequest) -> HttpResponse:
     if request.user.is_authenticated:
         return redirect("login_success")
@@ -180,24 +156,25 @@ def admin_dashboard(request: HttpRequest) -> HttpResponse:
         return HttpResponseForbidden("Admins only")
     classes_qs = (
         SchoolClass.objects.select_related("academic_year")
-        .prefetch_related(
-            Prefetch(
+        .annotate(
+            cached_student_total=models.Count("students"),
+            cached_photo_total=models.Count(
                 "students",
-                queryset=Student.objects.select_related("user"),
-            )
+                filter=models.Q(students__photo__isnull=False) & ~models.Q(students__photo=""),
+            ),
+            cached_encoding_total=models.Count("students", filter=models.Q(students__has_encoding=True)),
         )
     )
-    students_qs = Student.objects.select_related("school_class", "user").order_by("-user__date_joined")
+    students_qs = (
+        Student.objects.select_related("school_class", "user")
+        .defer("face_encodings")
+        .order_by("-user__date_joined")
+    )
     classes = list(classes_qs)
     students = list(students_qs)
-    for school_class in classes:
-        related_students = list(school_class.students.all())
-        school_class.cached_student_total = len(related_students)
-        school_class.cached_photo_total = sum(1 for s in related_students if s.photo)
-        school_class.cached_encoding_total = sum(1 for s in related_students if s.face_encodings)
     academic_years = list(AcademicYear.objects.all().order_by("-is_active", "-year"))
     active_years_count = sum(1 for year in academic_years if year.is_active)
-    students_with_encodings = sum(1 for s in students if s.face_encodings)
+    students_with_encodings = sum(1 for s in students if s.has_encoding)
     students_with_photos = sum(1 for s in students if s.photo)
     class_count = len(classes)
     student_count = len(students)
@@ -266,7 +243,7 @@ def admin_dashboard(request: HttpRequest) -> HttpResponse:
                 "initial": display_name[:1].upper(),
                 "photo_url": photo_url,
                 "has_photo": has_photo,
-                "face_ready": bool(getattr(stu, "face_encodings", None)),
+                "face_ready": stu.has_encoding,
                 "class_label": class_label,
                 "class_year": class_year,
                 "profile_url": profile_url,
@@ -306,6 +283,7 @@ def admin_students(request: HttpRequest) -> HttpResponse:
     )
     students_qs = (
         Student.objects.select_related("school_class", "user", "school_class__academic_year")
+        .defer("face_encodings")
         .order_by("user__first_name", "user__last_name")
     )
     students = list(students_qs)
@@ -321,7 +299,7 @@ def admin_students(request: HttpRequest) -> HttpResponse:
         form = StudentForm()
 
     student_count = len(students)
-    encoded_count = sum(1 for s in students if s.face_encodings)
+    encoded_count = sum(1 for s in students if s.has_encoding)
     photo_count = sum(1 for s in students if s.photo)
     class_count = len(classes)
     average_class_size = round(student_count / class_count, 1) if class_count else 0
@@ -356,7 +334,7 @@ def admin_students(request: HttpRequest) -> HttpResponse:
                 "photo_url": student.photo.url if student.photo else None,
                 "initials": initials,
                 "has_photo": bool(student.photo),
-                "face_ready": bool(student.face_encodings),
+                "face_ready": student.has_encoding,
                 "manage_url": reverse("student_detail", args=[student.pk]) if student.pk else None,
                 "admin_change_url": f"{admin_root}core/student/{student.pk}/change/",
                 "admin_delete_url": f"{admin_root}core/student/{student.pk}/delete/",
@@ -447,7 +425,7 @@ def take_attendance(request: HttpRequest, class_id: int) -> HttpResponse:
         return redirect('teacher_dashboard')
 
     # Get all students in the class
-    all_students = school_class.students.all().select_related('user')
+    all_students = school_class.students.all().select_related('user').defer('face_encodings')
 
     # Get a list of student IDs who already have a 'present' record today
     present_student_ids = set(AttendanceRecord.objects.filter(
@@ -458,7 +436,7 @@ def take_attendance(request: HttpRequest, class_id: int) -> HttpResponse:
     ).values_list('student_id', flat=True))
 
     get_token(request)
-    enc_count = sum(1 for s in all_students if s.face_encodings)
+    enc_count = school_class.students.filter(has_encoding=True).count()
     classes_for_user = list(_classes_for_user(request.user))
     snapshot = _attendance_snapshot(school_class, today)
     status_summary = _status_breakdown(snapshot)
@@ -556,7 +534,7 @@ def student_dashboard(request: HttpRequest) -> HttpResponse:
         return HttpResponseForbidden("Students only")
 
     try:
-        student = Student.objects.select_related("school_class").get(user=request.user)
+        student = Student.objects.select_related("school_class").defer("face_encodings").get(user=request.user)
     except Student.DoesNotExist:
         messages.error(request, "Student profile not found. Contact your administrator.")
         return redirect("logout_get")
@@ -603,16 +581,17 @@ def class_diagnostics(request: HttpRequest) -> JsonResponse:
         "face_recognition_available": face_recognition is not None,
         "opencv_available": cv2 is not None,
         "numpy_available": np is not None,
+        "gallery_cache": gallery_cache.cache_stats(),
         "students": [],
     }
-    for s in Student.objects.select_related('user').all():
+    for s in Student.objects.select_related('user').defer('face_encodings'):
         data["students"].append({
             "id": s.pk,
             "name": s.get_full_name(),
             "has_photo": bool(s.photo),
-            "has_encoding": bool(s.face_encodings),
+            "has_encoding": s.has_encoding,
         })
-    data["total_encodings"] = sum(1 for s in Student.objects.all() if s.face_encodings)
+    data["total_encodings"] = Student.objects.filter(has_encoding=True).count()
     return JsonResponse(data)
 
 
@@ -662,7 +641,7 @@ def attendance_student_history_api(request: HttpRequest, student_id: int) -> Jso
     if getattr(request.user, "role", None) not in {"teacher", "admin"}:
         return JsonResponse({"error": "Forbidden"}, status=403)
 
-    student = get_object_or_404(Student.objects.select_related("user", "school_class"), pk=student_id)
+    student = get_object_or_404(Student.objects.select_related("user", "school_class").defer("face_encodings"), pk=student_id)
 
     allowed_classes_qs = _classes_for_user(request.user)
     allowed_class_ids = set(allowed_classes_qs.values_list("id", flat=True))
@@ -711,12 +690,7 @@ def recognize_frame(request: HttpRequest) -> JsonResponse:
 
     # If face recognition libs aren't available, return a graceful empty result
     if (face_recognition is None) or (np is None):
-        return JsonResponse({
-            "faces_detected": 0,
-            "matched": [],
-            "detections": [],
-            "used_face_recognition": False,
-        })
+        return JsonResponse(live_recognition.RECOGNITION_UNAVAILABLE)
 
     try:
         data = json.loads(request.body)
@@ -728,47 +702,110 @@ def recognize_frame(request: HttpRequest) -> JsonResponse:
     if not class_id:
         return JsonResponse({"error": "class_id is required"}, status=400)
 
-    school_class = get_object_or_404(SchoolClass, id=class_id)
-    if not _user_can_access_class(request.user, school_class):
+    return _recognize(request, class_id, io.BytesIO(image_data), _frame_seq(data.get("seq")))
+
+
+@login_required
+@require_POST
+def recognize_frame_upload(request: HttpRequest) -> JsonResponse:
+    """
+    Same as ``recognize_frame``, but the JPEG bytes are the request body
+    (``application/octet-stream``) or a multipart ``frame`` file, with
+    ``class_id`` in the query string. Skips the base64 and JSON round trip.
+    """
+    if (face_recognition is None) or (np is None):
+        return JsonResponse(live_recognition.RECOGNITION_UNAVAILABLE)
+
+    try:
+        class_id = int(request.GET.get("class_id", ""))
+    except ValueError:
+        return JsonResponse({"error": "class_id is required"}, status=400)
+
+    image_source, error = _uploaded_frame(request)
+    if error is not None:
+        return error
+
+    seq = _frame_seq(request.headers.get("X-Frame-Seq") or request.GET.get("seq"))
+    return _recognize(request, class_id, image_source, seq)
+
+
+@require_POST
+async def recognize_frame_async(request: HttpRequest) -> JsonResponse:
+    """
+    Async variant of ``recognize_frame_upload`` for ASGI deployments.
+
+    Authentication and the class checks use the async ORM, and only decoding,
+    detection, matching and marking run on a bounded thread pool, so one ASGI
+    process can hold many camera sessions while the CPU-bound work runs in
+    parallel (or in the recognition pool, see ``recognition_pool``).
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Not authenticated"}, status=401)
+
+    if (face_recognition is None) or (np is None):
+        return JsonResponse(live_recognition.RECOGNITION_UNAVAILABLE)
+
+    try:
+        class_id = int(request.GET.get("class_id", ""))
+    except ValueError:
+        return JsonResponse({"error": "class_id is required"}, status=400)
+
+    # The ASGI handler has already buffered the body, so this does not block
+    image_source, error = _uploaded_frame(request)
+    if error is not None:
+        return error
+
+    school_class = await SchoolClass.objects.filter(id=class_id).afirst()
+    if school_class is None:
+        return JsonResponse({"error": "Class not found"}, status=404)
+    if not await live_recognition.auser_can_access_class(user, school_class):
         return JsonResponse({"error": "Forbidden"}, status=403)
 
-    # Decode the image using Pillow to avoid relying on cv2.imdecode
+    seq = _frame_seq(request.headers.get("X-Frame-Seq") or request.GET.get("seq"))
+    return await live_recognition.arecognize_in_session(user, school_class, image_source, seq)
+
+
+def _uploaded_frame(request: HttpRequest):
+    """Return ``(image_source, None)`` for an uploaded frame, or ``(None, error_response)``."""
+    if request.content_type == "multipart/form-data":
+        image_source = request.FILES.get("frame")
+        if image_source is None:
+            return None, JsonResponse({"error": "frame is required"}, status=400)
+        return image_source, None
+
+    # Reading the stream directly bypasses Django's body size check, so apply it here
     try:
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        frame_rgb = np.array(image)
-    except Exception:
-        return JsonResponse({"error": "Invalid image data"}, status=400)
-
-    # Get known faces for the class
-    known_face_encodings, known_face_metadata = _get_known_faces_for_class(class_id)
-
-    # Find matches
-    detections = recognition_service.find_matches_in_frame(frame_rgb, known_face_encodings, known_face_metadata)
-
-    # Get a list of matched student IDs and their confidence
-    matched_students_with_confidence = [
-        (d["student_id"], 1 - d["metric"]) 
-        for d in detections 
-        if d["student_id"] and d["metric"] is not None
-    ]
-    matched_student_ids = {d[0] for d in matched_students_with_confidence}
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if not content_length:
+        return None, JsonResponse({"error": "Empty frame"}, status=400)
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    if max_size is not None and content_length > max_size:
+        return None, JsonResponse({"error": "Frame too large"}, status=413)
+    # Pillow reads the request stream itself
+    return request, None
 
-    # Mark attendance in the database
-    if matched_students_with_confidence:
-        recognition_service.mark_attendance_for_matches(matched_students_with_confidence, class_id)
 
-    return JsonResponse({
-        "faces_detected": len(detections),
-        "matched": list(matched_student_ids),
-        "detections": detections,
-        "used_face_recognition": True,
-    })
+def _frame_seq(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _recognize(request: HttpRequest, class_id, image_source, seq: int | None = None) -> JsonResponse:
+    school_class = get_object_or_404(SchoolClass, id=class_id)
+    if not _user_can_access_class(request.user, school_class):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return live_recognition.recognize_in_session(request.user, school_class, image_source, seq)
 
 
 @login_required
 @require_POST
 def mark_present(request: HttpRequest, student_id: int) -> JsonResponse:
-    student = get_object_or_404(Student.objects.select_related("school_class"), pk=student_id)
+    student = get_object_or_404(Student.objects.select_related("school_class").defer("face_encodings"), pk=student_id)
     school_class = student.school_class
     if school_class is None:
         return JsonResponse({"ok": False, "error": "Student not in a class"}, status=400)
@@ -821,6 +858,9 @@ def mark_present(request: HttpRequest, student_id: int) -> JsonResponse:
         record.save(update_fields=["status", "confidence"])
         status_changed = True
 
+    if status_changed and previous_status == "present":
+        recognition_service.forget_present(school_class.id, today, student.pk)
+
     if teacher is not None and status_changed:
         ManualExcuseLog.objects.create(
             teacher=teacher,
@@ -842,20 +882,29 @@ def mark_present(request: HttpRequest, student_id: int) -> JsonResponse:
 
 @login_required
 def student_detail(request: HttpRequest, student_id: int) -> HttpResponse:
-    student = get_object_or_404(Student.objects.select_related('user', 'school_class'), pk=student_id)
+    student = get_object_or_404(Student.objects.select_related('user', 'school_class').defer('face_encodings'), pk=student_id)
     if request.method == 'POST':
         form = FaceSampleForm(request.POST, request.FILES)
         if form.is_valid():
             sample = form.save(commit=False)
             sample.student = student
             sample.save()
-            messages.success(request, "Face sample uploaded successfully.")
+            messages.success(request, "Face sample uploaded successfully. It will be ready for recognition once encoded.")
             return redirect('student_detail', student_id=student.pk)
     else:
         form = FaceSampleForm()
         
-    samples = student.samples.all().order_by('-created_at')
-    return render(request, 'admin/student_detail.html', {'student': student, 'form': form, 'samples': samples})
+    samples = list(student.samples.order_by('-created_at'))
+    # Latest encoding job per image; None is the main photo
+    jobs = {job.sample_id: job for job in student.encoding_jobs.order_by('pk')}
+    for sample in samples:
+        sample.encoding_job = jobs.get(sample.pk)
+    return render(request, 'admin/student_detail.html', {
+        'student': student,
+        'form': form,
+        'samples': samples,
+        'photo_job': jobs.get(None),
+    })
 
 
 @login_required
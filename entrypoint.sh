@@ -11,5 +11,36 @@ if [[ -n "${DJANGO_SUPERUSER_USERNAME:-}" ]] && [[ -n "${DJANGO_SUPERUSER_PASSWO
     --email "${DJANGO_SUPERUSER_EMAIL:-admin@example.com}" || true
 fi
 
-# Start server
-exec /opt/conda/bin/gunicorn config.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers ${WEB_CONCURRENCY:-2}
+server=(/opt/conda/bin/gunicorn config.wsgi:application --bind "0.0.0.0:${PORT:-8000}" --workers "${WEB_CONCURRENCY:-2}")
+
+# Set RUN_ENCODING_WORKER=false when a separate worker service runs
+# `manage.py run_encoding_worker`
+if [[ "${RUN_ENCODING_WORKER:-true}" != "true" ]]; then
+  # Start server
+  exec "${server[@]}"
+fi
+
+# Otherwise encode uploaded photos next to gunicorn. TERM/INT are passed on
+# to both, and the container stops when either exits, so the platform
+# restarts it instead of serving uploads that are never encoded.
+/opt/conda/bin/python manage.py run_encoding_worker &
+worker_pid=$!
+"${server[@]}" &
+server_pid=$!
+
+stopping=false
+stop() {
+  stopping=true
+  kill -TERM "$server_pid" "$worker_pid" 2>/dev/null || true
+}
+trap stop TERM INT
+
+# Returns when either process exits or a signal arrives
+wait -n "$server_pid" "$worker_pid" || true
+kill -TERM "$server_pid" "$worker_pid" 2>/dev/null || true
+wait "$server_pid" "$worker_pid" || true
+if [[ "$stopping" == "true" ]]; then
+  exit 0
+fi
+echo "gunicorn or the encoding worker exited; stopping" >&2
+exit 1